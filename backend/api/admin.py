@@ -1,27 +1,54 @@
 from django.contrib import admin
+from django.db.models import Count
 
 from api import models
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorite_recipe_count')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
     list_filter = ('tags__name',)
+    list_select_related = ('author',)
+    search_fields = ('name',)
+    autocomplete_fields = ('author',)
+    raw_id_fields = ('favorite', 'cart')
+    ordering = ('-id',)
+    show_full_result_count = False
     empty_value_display = '--empty--'
 
-    def favorite_recipe_count(self, obj):
-        return obj.favorite.count()
+    def get_queryset(self, request):
+        # Recipe.__str__ shows the author, also in autocomplete results
+        return super().get_queryset(request).select_related('author')
 
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
+    search_fields = ('name',)
+    ordering = ('name',)
+    show_full_result_count = False
+
+
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'color', 'recipes_total')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_total=Count('recipe'))
+
+    @admin.display(description='Рецептов', ordering='recipes_total')
+    def recipes_total(self, obj):
+        return obj.recipes_total
 
 
 class RecipeIngredientAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'ingredient')
-    list_filter = ('recipe__author',)
+    search_fields = ('recipe__name', 'recipe__author__username',
+                     'ingredient__name')
+    list_select_related = ('recipe__author', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
+    show_full_result_count = False
 
 
 admin.site.register(models.Recipe, RecipeAdmin)
 admin.site.register(models.Ingredient, IngredientAdmin)
-admin.site.register(models.Tag)
+admin.site.register(models.Tag, TagAdmin)
 admin.site.register(models.RecipeIngredient, RecipeIngredientAdmin)
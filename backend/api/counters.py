@@ -0,0 +1,65 @@
+""" Denormalized counters on Recipe and CustomUser.
+
+Recipe.favorites_count, Recipe.in_carts_count, CustomUser.recipes_count and
+CustomUser.followers_count are changed with F() expressions by the signal
+handlers in api.signals, in the same transaction as the rows they count.
+recount() recomputes them from scratch.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Recipe
+from users.models import CustomUser, Follow
+
+
+def change(queryset, field, delta):
+    """ Adds `delta` to `field` of every row in `queryset` """
+    if delta:
+        queryset.update(**{field: F(field) + delta})
+
+
+def count_of(queryset, field):
+    """ Subquery counting the rows of `queryset` whose `field` is OuterRef """
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')})
+            .order_by().values(field)
+            .annotate(total=Count('*')).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+# Model: {counter field: subquery with the actual value}
+COUNTERS = {
+    Recipe: {
+        'favorites_count': count_of(
+            Recipe.favorite.through.objects.all(), 'recipe'),
+        'in_carts_count': count_of(
+            Recipe.cart.through.objects.all(), 'recipe'),
+    },
+    CustomUser: {
+        'recipes_count': count_of(Recipe.objects.all(), 'author'),
+        'followers_count': count_of(Follow.objects.all(), 'author'),
+    },
+}
+
+
+def recount():
+    """ Repairs every counter that drifted, returns {model: rows fixed} """
+    repaired = {}
+    for model, counters in COUNTERS.items():
+        drifted = list(
+            model.objects.annotate(**{
+                f'actual_{field}': value for field, value in counters.items()
+            }).filter(reduce(or_, (
+                ~Q(**{field: F(f'actual_{field}')}) for field in counters
+            ))).values_list('pk', flat=True))
+        if drifted:
+            model.objects.filter(pk__in=drifted).update(**counters)
+        repaired[model] = len(drifted)
+    return repaired
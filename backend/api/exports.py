@@ -0,0 +1,58 @@
+""" Streamed shopping list exports.
+
+Every generator takes the list title and an iterable of
+(name, measurement unit, amount) rows and yields chunks of text.
+"""
+import csv
+import io
+import json
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'txt': 'text/plain; charset=utf-8',
+    'json': 'application/json',
+}
+
+
+def format_line(num, row):
+    """ Numbered '<name> <measurement unit> <amount>' line, as in the PDF """
+    return f'{num}. ' + ' '.join(str(value) for value in row)
+
+
+def as_text(title, rows):
+    yield f'{title}\n'
+    for num, row in enumerate(rows, start=1):
+        yield format_line(num, row) + '\n'
+
+
+def as_csv(title, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def as_json(title, rows):
+    yield json.dumps({'title': title}, ensure_ascii=False)[:-1]
+    yield ', "ingredients": ['
+    for num, (name, measurement_unit, amount) in enumerate(rows):
+        if num:
+            yield ', '
+        yield json.dumps({
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        }, ensure_ascii=False)
+    yield ']}'
+
+
+EXPORTERS = {
+    'csv': as_csv,
+    'txt': as_text,
+    'json': as_json,
+}
@@ -1,30 +1,145 @@
 import base64
-import imghdr
-import uuid
+import binascii
+import hashlib
+import re
 
 import six
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from api import images, uploads
+
+
+def parse_pk(model, value):
+    """ Primary key of `model` from a client value, None if malformed """
+    if isinstance(value, bool):
+        return None
+    try:
+        return model._meta.pk.to_python(value)
+    except (DjangoValidationError, TypeError, ValueError):
+        return None
+
+
+def resolve_pks(queryset, values, known=None):
+    """ Maps primary key values to objects of `queryset` in one query.
+        `known` is a {pk: object} map already loaded by the caller.
+    """
+    messages = serializers.PrimaryKeyRelatedField.default_error_messages
+    pks = []
+    for value in values:
+        pk = parse_pk(queryset.model, value)
+        if pk is None:
+            raise serializers.ValidationError(
+                messages['incorrect_type'].format(
+                    data_type=type(value).__name__),
+                code='incorrect_type')
+        pks.append(pk)
+    found = queryset.in_bulk(pks) if known is None else known
+    for value, pk in zip(values, pks):
+        if pk not in found:
+            raise serializers.ValidationError(
+                messages['does_not_exist'].format(pk_value=value),
+                code='does_not_exist')
+    return [found[pk] for pk in pks]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """ ManyRelatedField resolving the whole list with a single query,
+        or none when the serializer context carries `known_objects`
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        queryset = self.child_relation.get_queryset()
+        known = self.context.get('known_objects', {}).get(queryset.model)
+        return resolve_pks(queryset, list(data), known)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ With many=True looks up all primary keys at once """
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
 
 
 class Base64ImageField(serializers.ImageField):
+    """ Image sent as a base64 string or as a multipart file.
+        Only the image header is read to validate it, the pixels are never
+        decoded here. Files are named after the SHA-256 of their content:
+        an image that is already stored, such as the current one resent
+        with a PATCH, comes back as the name of the existing file and is
+        not written again. The name or URL of a stored photo is accepted
+        in place of its content.
+    """
+    default_error_messages = {
+        'too_large': 'Image must not exceed {max_size} bytes.',
+        'too_wide': 'Image sides must not exceed {max_dimension} pixels.',
+    }
+    stored_name = re.compile(r'[0-9a-f]{64}\.(%s)' % '|'.join(
+        sorted(set(uploads.FORMATS.values()))))
+
     def to_internal_value(self, data):
         if isinstance(data, six.string_types):
-            if 'data:' in data and ';base64,' in data:
-                header, data = data.split(';base64,')
-            try:
-                decoded_file = base64.b64decode(data)
-            except TypeError:
-                self.fail('invalid_image')
-
-            file_name = str(uuid.uuid4())[:12]
-            file_extension = self.get_file_extension(file_name, decoded_file)
-            complete_file_name = "%s.%s" % (file_name, file_extension, )
-            data = ContentFile(decoded_file, name=complete_file_name)
-
-        return super(Base64ImageField, self).to_internal_value(data)
-
-    def get_file_extension(self, file_name, decoded_file):
-        extension = imghdr.what(file_name, decoded_file)
-        extension = "jpg" if extension == "jpeg" else extension
-        return extension
+            name = data.rsplit('/', 1)[-1]
+            if (self.stored_name.fullmatch(name)
+                    and default_storage.exists(name)):
+                return name
+            data = self.decode(data)
+        elif not hasattr(data, 'chunks'):
+            self.fail('invalid')
+        if data.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+        header = uploads.read_header(data)
+        if header is None or header[0] not in uploads.FORMATS:
+            self.fail('invalid_image')
+        image_format, width, height = header
+
+        digest = hashlib.sha256()
+        for chunk in data.chunks():
+            digest.update(chunk)
+        data.seek(0)
+        name = "%s.%s" % (digest.hexdigest(), uploads.FORMATS[image_format])
+        if self.is_stored(name):
+            return name
+        if max(width, height) > settings.IMAGE_MAX_DIMENSION:
+            self.fail('too_wide', max_dimension=settings.IMAGE_MAX_DIMENSION)
+        data.name = name
+        return serializers.FileField.to_internal_value(self, data)
+
+    def decode(self, data):
+        if 'data:' in data and ';base64,' in data:
+            header, data = data.split(';base64,')
+        if len(data) * 3 // 4 > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+        try:
+            return ContentFile(base64.b64decode(data))
+        except (TypeError, binascii.Error):
+            self.fail('invalid_image')
+
+    def is_stored(self, name):
+        instance = getattr(self.parent, 'instance', None)
+        current = getattr(instance, self.source, None)
+        if current and current.name == name:
+            return True
+        return default_storage.exists(name)
+
+
+class ImageVariantsField(serializers.Field):
+    """ Read-only {variant: URL} of the resized recipe photos """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return images.variant_urls(recipe, self.context.get('request'))
@@ -1,7 +1,10 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Q
 from django_filters import rest_framework
 from rest_framework.filters import BaseFilterBackend
 
-from api.models import Ingredient
+from api.models import (RECIPE_SEARCH_VECTOR, SEARCH_CONFIG, Ingredient,
+                        RecipeIngredient)
 
 
 class IngredientFilter(rest_framework.FilterSet):
@@ -18,7 +21,28 @@ class IngredientFilter(rest_framework.FilterSet):
 
 class RecipeFilter(BaseFilterBackend):
     """ Lookup filter for Recipe model. """
+    @staticmethod
+    def search(queryset, text, with_ingredients=False):
+        """ Full-text search over recipe name and text, best matches first.
+            Optionally also matches recipes by a part of an ingredient name.
+        """
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type='websearch')
+        matches = Q(search=query)
+        if with_ingredients:
+            matches |= Q(id__in=RecipeIngredient.objects.filter(
+                ingredient__name__icontains=text).values('recipe'))
+        return queryset.annotate(
+            search=RECIPE_SEARCH_VECTOR,
+            rank=SearchRank(RECIPE_SEARCH_VECTOR, query),
+        ).filter(matches).order_by('-rank', '-id')
+
     def filter_queryset(self, request, queryset, view):
+        search = request.query_params.get('search')
+        if search:
+            queryset = self.search(
+                queryset, search,
+                request.query_params.get('search_ingredients') == '1')
 
         tags = request.query_params.getlist('tags')
         if tags:
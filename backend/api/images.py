@@ -0,0 +1,162 @@
+""" Resized variants of recipe photos.
+
+Uploaded photos are kept as sent; smaller copies for lists and cards are
+produced after the transaction commits, in a small per-process thread pool,
+and recorded in Recipe.image_variants. Until a variant exists its URL falls
+back to the original photo.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from api import jobs, signals
+from api.models import Recipe, Tag
+
+logger = logging.getLogger(__name__)
+
+# Variant name: the box the photo is fitted into
+VARIANTS = {
+    'thumbnail': (320, 320),
+    'card': (640, 640),
+    'full': (1280, 1280),
+}
+VARIANTS_DIR = 'variants'
+if features.check('webp'):
+    FORMAT, EXTENSION, SAVE_OPTIONS = 'WEBP', 'webp', {'quality': 80}
+else:
+    FORMAT, EXTENSION, SAVE_OPTIONS = 'JPEG', 'jpg', {
+        'quality': 80, 'optimize': True, 'progressive': True}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            thread_name_prefix='image-variants')
+    return _executor
+
+
+def variant_name(name, variant):
+    root = os.path.splitext(os.path.basename(name))[0]
+    return f'{VARIANTS_DIR}/{root}_{variant}.{EXTENSION}'
+
+
+def resize(image, size):
+    """ Fits the image into `size` and encodes it in the variant format """
+    has_alpha = (image.mode in ('RGBA', 'LA', 'PA')
+                 or 'transparency' in image.info)
+    mode = 'RGBA' if has_alpha and FORMAT != 'JPEG' else 'RGB'
+    image = image.convert(mode) if image.mode != mode else image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, FORMAT, **SAVE_OPTIONS)
+    return buf.getvalue()
+
+
+def open_image(name):
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    return image
+
+
+def generate(name, force=False):
+    """ Writes the variants of the stored image `name` that are missing,
+        or all of them with `force`, returns {variant: stored name}.
+        Stored images are named after their content, so variants already
+        on disk belong to the same picture and are reused.
+    """
+    image = None
+    variants = {}
+    for variant, size in VARIANTS.items():
+        target = variant_name(name, variant)
+        if default_storage.exists(target):
+            if not force:
+                variants[variant] = target
+                continue
+            default_storage.delete(target)
+        if image is None:
+            image = open_image(name)
+        variants[variant] = default_storage.save(
+            target, ContentFile(resize(image, size)))
+    return variants
+
+
+def process(name, recipe_ids, force=False):
+    """ Generates the variants of a photo and records them on the recipes
+        that show it, except those whose photo was replaced in the meantime.
+        Recipes sharing a photo must go through one call: the variant files
+        are named after the photo.
+    """
+    try:
+        variants = generate(name, force)
+        updated = Recipe.objects.filter(pk__in=recipe_ids, image=name).update(
+            image_variants=variants, updated_at=timezone.now())
+        if updated:
+            signals.bump_recipe_lists(Tag.objects.filter(
+                recipe__in=recipe_ids).values_list(
+                    'slug', flat=True).distinct())
+        return variants
+    except Exception:
+        logger.exception(
+            'Could not resize %s of recipes %s', name, list(recipe_ids))
+        raise
+    finally:
+        connection.close()
+
+
+def by_photo(pairs):
+    """ {photo name: [recipe ids]} from (recipe id, photo name) pairs """
+    recipes = {}
+    for recipe_id, name in pairs:
+        recipes.setdefault(name, []).append(recipe_id)
+    return recipes
+
+
+def schedule(*recipes):
+    """ Queues variant generation for the recipes' current photos
+        once the surrounding transaction commits, in the process thread pool
+        or as background jobs with IMAGE_VARIANT_JOBS
+    """
+    photos = by_photo(
+        (recipe.pk, recipe.image.name) for recipe in recipes if recipe.image)
+
+    def submit():
+        executor = get_executor()
+        for name, recipe_ids in photos.items():
+            executor.submit(process, name, recipe_ids)
+
+    if not photos:
+        return
+    if settings.IMAGE_VARIANT_JOBS:
+        for name, recipe_ids in photos.items():
+            jobs.enqueue('image_variants', recipe_ids=recipe_ids, image=name)
+    else:
+        transaction.on_commit(submit)
+
+
+def variant_urls(recipe, request=None):
+    """ {variant: absolute URL}, the original photo standing in
+        for variants not generated yet
+    """
+    if not recipe.image:
+        return {}
+    urls = {}
+    for variant in VARIANTS:
+        name = recipe.image_variants.get(variant)
+        url = default_storage.url(name) if name else recipe.image.url
+        urls[variant] = (
+            request.build_absolute_uri(url) if request is not None else url)
+    return urls
@@ -0,0 +1,61 @@
+""" Per-process prefix index for ingredient autocomplete.
+
+The index is built lazily from the whole catalog and rebuilt whenever the
+ingredients version changes, which happens on every Ingredient save or
+delete in any worker.
+"""
+import threading
+from bisect import bisect_left
+from itertools import islice
+
+from api import versions
+from api.models import Ingredient
+
+MAX_RESULTS = 50
+
+
+class IngredientIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        # (keys, ingredients), replaced as a whole so that readers outside
+        # the lock never pair the keys of one build with another's items
+        self._entries = ([], [])
+
+    def _build(self):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (ingredient.name.casefold(), ingredient.id))
+        keys = [ingredient.name.casefold() for ingredient in ingredients]
+        self._entries = (keys, ingredients)
+
+    def _refresh(self):
+        version = versions.get(versions.INGREDIENTS)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build()
+                    self._version = version
+        return self._entries
+
+    def search(self, query, limit=MAX_RESULTS):
+        """ Ingredients whose name starts with `query`, followed by those
+            containing it elsewhere, case-insensitive and at most `limit`
+        """
+        keys, ingredients = self._refresh()
+        query = query.casefold()
+        results = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(results) < limit
+               and keys[position].startswith(query)):
+            results.append(ingredients[position])
+            position += 1
+        results.extend(islice((
+            ingredient
+            for key, ingredient in zip(keys, ingredients)
+            if query in key and not key.startswith(query)
+        ), limit - len(results)))
+        return results
+
+
+index = IngredientIndex()
@@ -0,0 +1,112 @@
+""" A small job queue kept in the database.
+
+Jobs are rows of api.Job claimed by the run_workers command. Claiming uses
+SELECT ... FOR UPDATE SKIP LOCKED where the database supports it and a
+conditional UPDATE everywhere, so any number of workers can poll the same
+table. A failed job is retried with exponential backoff until it runs out
+of attempts; a job whose worker died is picked up again once it has been
+running for longer than JOB_TIMEOUT. Finished jobs are deleted with their
+files by purge() once they are older than JOB_RESULT_TTL.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Job kind: callable taking the Job and returning a JSON-serializable result
+TASKS = {}
+
+
+def task(kind):
+    """ Registers the decorated function as the handler of `kind` jobs """
+    def register(func):
+        TASKS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, user=None, **payload):
+    """ Queues a `kind` job, visible to workers once the surrounding
+        transaction commits
+    """
+    if kind not in TASKS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    return Job.objects.create(kind=kind, user=user, payload=payload)
+
+
+def backoff(attempts):
+    """ Seconds to wait before the next attempt """
+    return settings.JOB_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def claim():
+    """ Marks the next due job as running and returns it, None if idle """
+    now = timezone.now()
+    due = Job.objects.filter(
+        Q(status=Job.PENDING, run_after__lte=now)
+        | Q(status=Job.RUNNING,
+            started_at__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+    ).order_by('run_after', 'id')
+    with transaction.atomic():
+        job = due.select_for_update(skip_locked=True).first()
+        if job is None:
+            return None
+        claimed = due.filter(pk=job.pk).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1, started_at=now)
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def run(job):
+    """ Runs a claimed job and records the outcome """
+    try:
+        job.result = TASKS[job.kind](job)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = backoff(job.attempts)
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+            logger.warning('Job %s #%s failed, retrying in %ss',
+                           job.kind, job.pk, delay)
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            logger.error('Job %s #%s failed:\n%s', job.kind, job.pk, job.error)
+    else:
+        job.status = Job.SUCCEEDED
+        job.error = ''
+        job.finished_at = timezone.now()
+        logger.info('Job %s #%s done in %s attempt(s)',
+                    job.kind, job.pk, job.attempts)
+    job.save()
+    return job
+
+
+def run_next():
+    """ Claims and runs one job, returns it or None if the queue is idle """
+    job = claim()
+    return run(job) if job is not None else None
+
+
+def purge(older_than=None):
+    """ Deletes jobs finished more than `older_than` seconds ago
+        (JOB_RESULT_TTL by default), returns how many were deleted
+    """
+    if older_than is None:
+        older_than = settings.JOB_RESULT_TTL
+    deleted, _ = Job.objects.filter(
+        status__in=(Job.SUCCEEDED, Job.FAILED),
+        finished_at__lt=timezone.now() - timedelta(seconds=older_than),
+    ).delete()
+    return deleted
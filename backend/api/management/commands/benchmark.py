@@ -0,0 +1,383 @@
+import base64
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.test import APIClient
+
+from api import jobs, seeding
+from api.models import Ingredient, Recipe, RecipeIngredient, Tag
+from foodgram.settings import BASE_DIR
+from users.models import CustomUser, Follow
+
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'data', 'benchmark_baseline.json')
+# Latency differences below this many milliseconds are never a regression
+LATENCY_NOISE_MS = 2.0
+
+# `data` names a payload, `prepare` a function creating the objects a single
+# request consumes, whose result is added to the fixture for that request.
+# `index` must appear in the plan of one of the queries of the route.
+Route = namedtuple(
+    'Route', 'name method path data user undo prepare index',
+    defaults=(None, 'viewer', None, None, None))
+
+ROUTES = (
+    Route('recipes-list-anonymous', 'get', '/api/recipes/?limit=6',
+          user='anonymous'),
+    Route('recipes-list', 'get', '/api/recipes/?page=2&limit=6'),
+    Route('recipes-list-cursor', 'get',
+          '/api/recipes/?pagination=cursor&limit=6'),
+    Route('recipes-filter-tags', 'get',
+          '/api/recipes/?tags={tag}&tags={other_tag}'),
+    Route('recipes-filter-author', 'get', '/api/recipes/?author={author}'),
+    Route('recipes-filter-favorited', 'get', '/api/recipes/?is_favorited=1'),
+    Route('recipes-filter-cart', 'get',
+          '/api/recipes/?is_in_shopping_cart=1'),
+    Route('recipes-filter-all', 'get',
+          '/api/recipes/?is_favorited=1&is_in_shopping_cart=1'
+          '&tags={tag}&author={author}'),
+    Route('recipes-search', 'get', '/api/recipes/?search={search}',
+          index='recipe_search_idx'),
+    Route('recipes-search-ingredients', 'get',
+          '/api/recipes/?search={ingredient_prefix}&search_ingredients=1',
+          index='ingredient_name_trgm_idx'),
+    Route('recipes-detail', 'get', '/api/recipes/{recipe}/'),
+    Route('recipes-detail-anonymous', 'get', '/api/recipes/{recipe}/',
+          user='anonymous'),
+    Route('recipes-create', 'post', '/api/recipes/', data='recipe'),
+    Route('recipes-update', 'patch', '/api/recipes/{own_recipe}/',
+          data='recipe'),
+    Route('recipes-bulk-create', 'post', '/api/recipes/bulk/',
+          data='recipes'),
+    Route('recipes-delete', 'delete', '/api/recipes/{new_recipe}/',
+          prepare='recipe'),
+    Route('recipes-favorite', 'post', '/api/recipes/{recipe}/favorite/',
+          undo='delete'),
+    Route('recipes-shopping-cart', 'post',
+          '/api/recipes/{recipe}/shopping_cart/', undo='delete'),
+    Route('cart-download-pdf', 'get', '/api/recipes/download_shopping_cart/'),
+    Route('cart-download-csv', 'get',
+          '/api/recipes/download_shopping_cart/?format=csv'),
+    Route('cart-download-async', 'get',
+          '/api/recipes/download_shopping_cart/?async=1'),
+    Route('jobs-detail', 'get', '/api/jobs/{job}/'),
+    Route('jobs-download', 'get', '/api/jobs/{job}/download/'),
+    Route('users-list', 'get', '/api/users/?limit=6'),
+    Route('users-create', 'post', '/api/users/', data='user',
+          user='anonymous'),
+    Route('users-set-password', 'post', '/api/users/set_password/',
+          data='password'),
+    Route('users-detail', 'get', '/api/users/{author}/'),
+    Route('users-me', 'get', '/api/users/me/'),
+    Route('users-subscriptions', 'get',
+          '/api/users/subscriptions/?recipes_limit=3'),
+    Route('users-subscribe', 'post', '/api/users/{stranger}/subscribe/',
+          undo='delete'),
+    Route('tags-list', 'get', '/api/tags/'),
+    Route('tags-detail', 'get', '/api/tags/{tag_id}/'),
+    Route('ingredients-search', 'get',
+          '/api/ingredients/?name={ingredient_prefix}'),
+    Route('ingredients-detail', 'get', '/api/ingredients/{ingredient}/'),
+)
+
+
+def build_fixture(user_ids):
+    """ Objects of the seeded dataset the routes refer to """
+    # The most active seeded author, so that every route has data
+    viewer = CustomUser.objects.filter(
+        pk__in=user_ids, recipes_count__gt=0,
+    ).annotate(follows=Count('follower')).order_by('-follows', 'pk').first()
+    followed = Follow.objects.filter(user=viewer).values_list(
+        'author', flat=True)
+    author = CustomUser.objects.filter(
+        pk__in=followed, recipes_count__gt=0,
+    ).order_by('-recipes_count', 'pk').values_list('pk', flat=True).first()
+    # A recipe matching every filter of recipes-filter-all
+    tag = Tag.objects.get(slug=seeding.TAGS[0][2])
+    matching = Recipe.objects.filter(author=author).order_by('pk').first()
+    matching.tags.add(tag)
+    matching.favorite.add(viewer)
+    matching.cart.add(viewer)
+    own_recipe = Recipe.objects.filter(author=viewer).order_by('pk').first()
+    recipe = Recipe.objects.exclude(author=viewer).exclude(
+        favorite=viewer).exclude(cart=viewer).order_by('pk').first()
+    stranger = CustomUser.objects.exclude(pk=viewer.pk).exclude(
+        pk__in=followed).order_by('pk').first()
+    ingredients = list(Ingredient.objects.order_by('pk')[:5])
+    with default_storage.open(seeding.PLACEHOLDER_NAME) as file:
+        image = 'data:image/jpeg;base64,' + base64.b64encode(
+            file.read()).decode()
+    tag_ids = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+    job = jobs.run(jobs.enqueue('shopping_list_pdf', user=viewer))
+    recipe_data = {
+        'name': 'Суп бенчмарк',
+        'text': 'Описание рецепта.',
+        'cooking_time': 20,
+        'image': image,
+        'tags': tag_ids[:2],
+        'ingredients': [
+            {'id': ingredient.pk, 'amount': 100} for ingredient in ingredients
+        ],
+    }
+    return viewer, {
+        'author': author,
+        'recipe': recipe.pk,
+        'own_recipe': own_recipe.pk,
+        'job': job.pk,
+        'stranger': stranger.pk,
+        'tag': tag.slug,
+        'other_tag': seeding.TAGS[2][2],
+        'tag_id': tag_ids[0],
+        'search': seeding.DISHES[0],
+        'ingredient': ingredients[0].pk,
+        'ingredient_prefix': ingredients[0].name[:3],
+    }, recipe_data
+
+
+def new_user_data(number):
+    return {
+        'username': f'benchmark{number}',
+        'email': f'benchmark{number}@example.com',
+        'first_name': 'Имя',
+        'last_name': 'Фамилия',
+        'password': seeding.PASSWORD,
+    }
+
+
+def new_recipe(author):
+    """ A recipe in its author's cart, for the delete route to remove """
+    recipe = Recipe.objects.create(
+        author=author, name='Удаляемый рецепт', text='Описание рецепта.',
+        image=seeding.PLACEHOLDER_NAME, cooking_time=10)
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=100)
+        for ingredient in Ingredient.objects.order_by('pk')[:5])
+    recipe.tags.set(Tag.objects.order_by('pk')[:2])
+    recipe.cart.add(author)
+    return recipe
+
+
+def uses_index(queries, index):
+    """ Whether the plan of one of the captured SELECTs uses `index`.
+        Sequential scans are disabled, so that the answer depends on the
+        index matching the query and not on the size of the tables.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        for query in queries:
+            if not query['sql'].lstrip().upper().startswith('SELECT'):
+                continue
+            cursor.execute(f'EXPLAIN {query["sql"]}')
+            if any(index in line for line, in cursor.fetchall()):
+                return True
+    return False
+
+
+def compare(result, expected, options):
+    """ Reasons the route fails against its baseline entry """
+    problems = []
+    if result['status'] >= 400:
+        problems.append('error')
+    if result.get('index') is False:
+        problems.append('index')
+    if expected is None:
+        return problems
+    if result['queries'] > expected['queries']:
+        problems.append('queries')
+    base_ms = expected['median_ms']
+    if (not options['no_latency']
+            and result['median_ms'] > base_ms * (
+                1 + options['latency_tolerance'])
+            and result['median_ms'] - base_ms > LATENCY_NOISE_MS):
+        problems.append('latency')
+    return problems
+
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway test database and checks the query count '
+            'and latency of every API route against a stored baseline, '
+            'and that search queries use their indexes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Timed requests per route, the median is compared')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Store the measurements as the new baseline')
+        parser.add_argument(
+            '--latency-tolerance', type=float, default=1.0,
+            help='Allowed slowdown against the baseline, 1.0 is +100%%')
+        parser.add_argument(
+            '--no-latency', action='store_true',
+            help='Only check query counts')
+        parser.add_argument(
+            '--route', action='append', default=[],
+            help='Only run routes whose name contains this text')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(
+                        MEDIA_ROOT=media_root,
+                        METRICS_DIR=os.path.join(media_root, 'metrics'),
+                        IMAGE_VARIANT_JOBS=True,
+                        # In memory, so that cache reads are not counted
+                        # as queries of the routes
+                        CACHES={alias: {'BACKEND': 'django.core.cache.'
+                                        'backends.locmem.LocMemCache'}
+                                for alias in ('default', 'versions')}):
+                    results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.report(results, options)
+
+    def request(self, client, route, path, data):
+        response = getattr(client, route.method)(path, data, format='json')
+        if response.streaming:
+            # Streamed bodies run their queries while being consumed
+            b''.join(response.streaming_content)
+        response.close()
+        return response
+
+    def undo(self, client, route, path):
+        """ Reverts the request so that the next one does the same work """
+        if route.undo:
+            getattr(client, route.undo)(path)
+
+    def run(self, options):
+        started = time.perf_counter()
+        dataset = seeding.generate(
+            users=options['users'], recipes=options['recipes'],
+            seed=options['seed'])
+        self.stdout.write(
+            f'Seeded {options["users"]} users and {options["recipes"]} '
+            f'recipes in {time.perf_counter() - started:.1f}s')
+        viewer, fixture, recipe_data = build_fixture(dataset['users'])
+        clients = {'anonymous': APIClient(), 'viewer': APIClient()}
+        clients['viewer'].force_authenticate(viewer)
+        numbers = itertools.count()
+        payloads = {
+            'recipe': lambda: recipe_data,
+            'recipes': lambda: [recipe_data] * 10,
+            'user': lambda: new_user_data(next(numbers)),
+            'password': lambda: {
+                'current_password': seeding.PASSWORD,
+                'new_password': seeding.PASSWORD,
+            },
+        }
+        preparers = {
+            'recipe': lambda: {'new_recipe': new_recipe(viewer).pk},
+        }
+        # Imports, URL resolvers and per-process caches are built lazily
+        clients['viewer'].get('/api/recipes/')
+
+        results = {}
+        for route in ROUTES:
+            if options['route'] and not any(
+                    part in route.name for part in options['route']):
+                continue
+            client = clients[route.user]
+
+            def arguments(route=route):
+                """ Path and payload of one request, built untimed """
+                extra = preparers[route.prepare]() if route.prepare else {}
+                data = payloads[route.data]() if route.data else None
+                return route.path.format(**fixture, **extra), data
+
+            cache.clear()
+            path, data = arguments()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.request(client, route, path, data)
+            # Every request resets the query log, read it before the next one
+            captured = queries.captured_queries
+            self.undo(client, route, path)
+            timings = []
+            for _ in range(options['repeat']):
+                path, data = arguments()
+                request_started = time.perf_counter()
+                self.request(client, route, path, data)
+                timings.append(time.perf_counter() - request_started)
+                self.undo(client, route, path)
+            results[route.name] = {
+                'status': response.status_code,
+                'queries': len(captured),
+                'median_ms': round(statistics.median(timings) * 1000, 2),
+            }
+            if route.index:
+                results[route.name]['index'] = uses_index(
+                    captured, route.index)
+        return results
+
+    def report(self, results, options):
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            baseline = {}
+        header = ('Route', 'Status', 'Queries', 'Budget', 'Median ms',
+                  'Baseline ms', 'Change', 'Result')
+        rows, failures = [], []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            problems = compare(result, expected, options)
+            if expected is None:
+                budget = base_ms = change = '-'
+                verdict = 'new'
+            else:
+                budget, base_ms = expected['queries'], expected['median_ms']
+                change = (f'{(result["median_ms"] / base_ms - 1) * 100:+.0f}%'
+                          if base_ms else '-')
+                verdict = 'ok'
+            if problems:
+                verdict = 'FAIL: ' + ', '.join(problems)
+                failures.append(name)
+            rows.append((name, result['status'], result['queries'], budget,
+                         result['median_ms'], base_ms, change, verdict))
+
+        widths = [
+            max(len(str(row[index])) for row in (header, *rows))
+            for index in range(len(header))
+        ]
+        for row in (header, *rows):
+            self.stdout.write('  '.join(
+                str(value).ljust(width) for value, width in zip(row, widths)))
+
+        if options['update_baseline']:
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    name: {
+                        'queries': result['queries'],
+                        'median_ms': result['median_ms'],
+                    }
+                    for name, result in results.items()
+                }, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Baseline written to {options["baseline"]}'))
+            return
+        if failures:
+            raise CommandError(
+                f'{len(failures)} route(s) regressed: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS('All routes within budget'))
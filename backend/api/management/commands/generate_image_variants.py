@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from api import images
+from api.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generates resized variants of recipe photos that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Regenerate variants of every recipe photo')
+        parser.add_argument(
+            '--workers', type=int, default=settings.IMAGE_VARIANT_WORKERS,
+            help='Photos resized in parallel')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(
+                ~Q(image_variants__has_keys=list(images.VARIANTS)))
+        # Recipes sharing a photo share its variant files, each photo is
+        # resized by a single task
+        photos = images.by_photo(recipes.values_list('pk', 'image'))
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [
+                executor.submit(
+                    images.process, name, recipe_ids, options['all'])
+                for name, recipe_ids in photos.items()
+            ]
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Resized {len(photos) - failed} photos, {failed} failed'))
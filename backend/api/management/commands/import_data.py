@@ -1,23 +1,136 @@
 import csv
+import json
 import os
+import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from api import versions
 from api.models import Ingredient
 from foodgram.settings import BASE_DIR
 
+DEFAULT_FILE = os.path.join(BASE_DIR, 'data', 'ingredients.csv')
+HEADER = ('name', 'measurement_unit')
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2 and tuple(row[:2]) != HEADER:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    for item in json.load(file):
+        yield item['name'], item['measurement_unit']
+
+
+def unique_rows(rows):
+    """ Drops blank and repeated (name, measurement_unit) pairs """
+    seen = set()
+    for name, measurement_unit in rows:
+        row = (name.strip(), measurement_unit.strip())
+        if row[0] and row not in seen:
+            seen.add(row)
+            yield row
+
+
+class Counted:
+    """ Iterator wrapper remembering how many items went through it """
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self._iterator)
+        self.count += 1
+        return item
+
+
+class RowsFile:
+    """ File-like CSV view of the rows, consumed lazily by COPY """
+    def __init__(self, rows):
+        self._lines = (
+            ','.join('"{}"'.format(value.replace('"', '""'))
+                     for value in row) + '\n'
+            for row in rows
+        )
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
 
 class Command(BaseCommand):
+    help = ('Imports ingredients from a CSV or JSON file. Existing '
+            'ingredients are skipped, so the import can be re-run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', default=DEFAULT_FILE,
+            help='Path to a .csv or .json file with ingredients')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows per INSERT')
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Load through COPY into a staging table (PostgreSQL only)')
+
+    def _bulk_insert(self, rows, batch_size):
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in batch),
+                ignore_conflicts=True,
+            )
+
+    def _copy_insert(self, rows):
+        if connection.vendor != 'postgresql':
+            raise CommandError('--copy requires PostgreSQL')
+        buf = RowsFile(rows)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_staging '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP')
+            cursor.copy_expert(
+                'COPY ingredient_staging FROM STDIN WITH (FORMAT csv)', buf)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT name, measurement_unit FROM ingredient_staging '
+                f'ON CONFLICT DO NOTHING')
+
     def handle(self, *args, **options):
-        file = open(os.path.join(BASE_DIR, 'data', 'ingredients.csv'))
-        read_file = csv.reader(file)
-        count = 1
-        for ingredient in read_file:
-            if count == 1:
-                pass
-            else:
-                # Specify model and query details here
-                Ingredient.objects.get_or_create(
-                    name=ingredient[0],
-                    measurement_unit=ingredient[1])
-            count += 1
+        path = options['file']
+        reader = read_json if path.endswith('.json') else read_csv
+        started = time.perf_counter()
+        before = Ingredient.objects.count()
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = Counted(unique_rows(reader(file)))
+            with transaction.atomic():
+                if options['copy']:
+                    self._copy_insert(rows)
+                else:
+                    self._bulk_insert(rows, options['batch_size'])
+        versions.bump(versions.INGREDIENTS)
+        elapsed = time.perf_counter() - started
+        created = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {rows.count} ingredients, added {created} '
+            f'in {elapsed:.2f}s ({rows.count / elapsed:.0f} rows/s)'))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = 'Deletes finished background jobs and their result files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=settings.JOB_RESULT_TTL,
+            help='Only jobs finished this many seconds ago or earlier')
+
+    def handle(self, *args, **options):
+        deleted = jobs.purge(options['older_than'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} job(s) deleted'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api import shopping_cart
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds aggregated shopping cart totals from the carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, nargs='+', dest='user_ids',
+            help='Only rebuild the carts of these user ids')
+
+    def handle(self, *args, **options):
+        shopping_cart.rebuild(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS('Shopping carts rebuilt'))
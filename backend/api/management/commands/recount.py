@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api import counters
+
+
+class Command(BaseCommand):
+    help = ('Recomputes denormalized favorites, cart, recipe '
+            'and follower counts')
+
+    def handle(self, *args, **options):
+        for model, rows in counters.recount().items():
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: {rows} repaired'))
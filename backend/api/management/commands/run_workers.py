@@ -0,0 +1,98 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from api import jobs
+from foodgram import metrics
+
+
+def work(stop, poll_interval, burst):
+    """ Runs jobs until `stop` is set, or until the queue is idle in burst
+        mode. Every thread uses its own database connection.
+    """
+    try:
+        while not stop.is_set():
+            if jobs.run_next() is None:
+                if burst:
+                    return
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+
+
+def serve(threads, poll_interval, burst):
+    """ Runs a pool of worker threads in the current process """
+    metrics.enable()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    workers = [
+        threading.Thread(
+            target=work, args=(stop, poll_interval, burst),
+            name=f'job-worker-{number}')
+        for number in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(timeout=1)
+    except KeyboardInterrupt:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+class Command(BaseCommand):
+    help = ('Runs background jobs from the database queue '
+            'in a pool of processes and threads')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.JOB_WORKER_PROCESSES,
+            help='Worker processes')
+        parser.add_argument(
+            '--threads', type=int, default=settings.JOB_WORKER_THREADS,
+            help='Worker threads in every process')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait when the queue is empty')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        serve_args = (
+            options['threads'], options['poll_interval'], options['burst'])
+        self.stdout.write(
+            f'Running {options["processes"]} process(es) '
+            f'x {options["threads"]} thread(s)')
+        if options['processes'] <= 1:
+            serve(*serve_args)
+            return
+        # Children must not share the parent's database connections
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=serve, args=serve_args)
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+
+        def terminate(*args):
+            # Every child stops taking jobs and finishes the running ones
+            for process in processes:
+                process.terminate()
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import seeding
+
+
+class Command(BaseCommand):
+    help = ('Generates users, recipes, favorites, carts and follows '
+            'with realistic skewed distributions for load testing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Favorite recipes per user on average')
+        parser.add_argument(
+            '--cart', type=float, default=5,
+            help='Recipes in the shopping cart per user on average')
+        parser.add_argument(
+            '--follows', type=float, default=10,
+            help='Followed authors per user on average')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed, the same seed gives the same data')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows per COPY or INSERT')
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Use bulk INSERTs on PostgreSQL too')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        created = seeding.generate(
+            users=options['users'], recipes=options['recipes'],
+            favorites=options['favorites'], cart=options['cart'],
+            follows=options['follows'], seed=options['seed'],
+            batch_size=options['batch_size'],
+            use_copy=not options['no_copy'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(created["users"])} users and '
+            f'{len(created["recipes"])} recipes in '
+            f'{time.perf_counter() - started:.1f}s, '
+            f'password "{seeding.PASSWORD}"'))
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.12 on 2026-10-18 05:18
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_cart_totals(apps, schema_editor):
+    """ Builds the totals of the carts that already exist """
+    RecipeIngredient = apps.get_model('api', 'RecipeIngredient')
+    CartIngredient = apps.get_model('api', 'CartIngredient')
+    totals = RecipeIngredient.objects.filter(
+        recipe__cart__isnull=False,
+    ).values('recipe__cart', 'ingredient').annotate(
+        total=Sum('amount'),
+    ).values_list('recipe__cart', 'ingredient', 'total')
+    CartIngredient.objects.bulk_create(
+        (CartIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, total_amount=total)
+         for user_id, ingredient_id, total in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0013_rename_description_recipe_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.IntegerField(verbose_name='Общее количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_totals', to='api.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в списке покупок',
+                'verbose_name_plural': 'Ингредиенты в списке покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_ingredient_constraint'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.12 on 2026-10-18 05:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_cartingredient'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('name', 'text', config='russian'), name='recipe_search_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_recipe_search'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Serves the UPPER(name) LIKE UPPER('%...%') of name__icontains
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX ingredient_name_trgm_idx ON api_ingredient '
+                'USING gin (UPPER(name) gin_trgm_ops);'
+            ),
+            reverse_sql='DROP INDEX ingredient_name_trgm_idx;',
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.12 on 2026-10-18 05:27
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Q
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """ Folds every duplicated (name, measurement_unit) into its first row.
+        A recipe listing several of the duplicates keeps one row with the
+        sum of their amounts, as the cart totals merged below do.
+    """
+    Ingredient = apps.get_model('api', 'Ingredient')
+    RecipeIngredient = apps.get_model('api', 'RecipeIngredient')
+    CartIngredient = apps.get_model('api', 'CartIngredient')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit').annotate(
+        keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        keep = group['keep']
+        extra = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit'],
+        ).exclude(id=keep)
+        rows = RecipeIngredient.objects.filter(
+            Q(ingredient=keep) | Q(ingredient__in=extra))
+        recipes = {}
+        for row in rows.order_by('id'):
+            recipes.setdefault(row.recipe_id, []).append(row)
+        for recipe_rows in recipes.values():
+            kept = next(
+                (row for row in recipe_rows if row.ingredient_id == keep),
+                recipe_rows[0])
+            RecipeIngredient.objects.filter(id__in=[
+                row.id for row in recipe_rows if row.id != kept.id
+            ]).delete()
+            kept.ingredient_id = keep
+            kept.amount = sum(row.amount for row in recipe_rows)
+            kept.save()
+        for row in CartIngredient.objects.filter(ingredient__in=extra):
+            kept, _ = CartIngredient.objects.get_or_create(
+                user_id=row.user_id, ingredient_id=keep,
+                defaults={'total_amount': 0})
+            kept.total_amount += row.total_amount
+            kept.save()
+        extra.delete()
+    # Deferred foreign key checks of the deleted rows must run before the
+    # constraint is added in the same transaction
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_unit_constraint'),
+        ),
+    ]
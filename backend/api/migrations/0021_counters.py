@@ -0,0 +1,50 @@
+# Generated by Django 3.2.12 on 2026-10-18 05:38
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        .annotate(total=Count('*')).values('total'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    Follow = apps.get_model('users', 'Follow')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Recipe.objects.update(
+        favorites_count=count_of(
+            Recipe.favorite.through.objects.all(), 'recipe'),
+        in_carts_count=count_of(Recipe.cart.through.objects.all(), 'recipe'),
+    )
+    CustomUser.objects.update(
+        recipes_count=count_of(Recipe.objects.all(), 'author'),
+        followers_count=count_of(Follow.objects.all(), 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_job'),
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В избранном у'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В корзинах у'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.12 on 2026-10-18 09:12
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+import api.models
+
+
+def move_results(apps, schema_editor):
+    """ Moves job files out of the publicly served MEDIA_ROOT """
+    Job = apps.get_model('api', 'Job')
+    private = api.models.private_storage()
+    for job in Job.objects.exclude(result_file='').only('result_file'):
+        name = job.result_file.name
+        if not default_storage.exists(name):
+            continue
+        with default_storage.open(name) as file:
+            job.result_file.name = private.save(name, file)
+        job.save(update_fields=['result_file'])
+        default_storage.delete(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='result_file',
+            field=models.FileField(blank=True, storage=api.models.private_storage, upload_to='jobs/', verbose_name='Файл результата'),
+        ),
+        migrations.RunPython(move_results, migrations.RunPython.noop),
+    ]
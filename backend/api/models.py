@@ -1,8 +1,18 @@
+import os
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.core.files.storage import FileSystemStorage
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 
 from users.models import CustomUser
 
+SEARCH_CONFIG = 'russian'
+RECIPE_SEARCH_VECTOR = SearchVector('name', 'text', config=SEARCH_CONFIG)
+
 
 class Ingredient(models.Model):
     name = models.CharField(max_length=200, verbose_name='Ингредиент')
@@ -12,6 +22,11 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit_constraint')
+        ]
 
     def __str__(self) -> str:
         return f'{self.name} ({self.measurement_unit})'
@@ -38,6 +53,9 @@ class Recipe(models.Model):
         related_name='recipes')
     name = models.CharField(max_length=64, verbose_name='Рецепт')
     image = models.ImageField(verbose_name='Фото')
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False,
+        verbose_name='Уменьшенные копии фото')
     text = models.TextField(verbose_name='Описание рецепта')
     ingredients = models.ManyToManyField(
         to=Ingredient,
@@ -58,10 +76,19 @@ class Recipe(models.Model):
     cart = models.ManyToManyField(
         CustomUser, verbose_name='В корзине', related_name='shopping_cart',
         blank=True)
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name='Дата изменения')
+    favorites_count = models.IntegerField(
+        default=0, editable=False, verbose_name='В избранном у')
+    in_carts_count = models.IntegerField(
+        default=0, editable=False, verbose_name='В корзинах у')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            GinIndex(RECIPE_SEARCH_VECTOR, name='recipe_search_idx'),
+        ]
 
     def __str__(self) -> str:
         return f'Рецепт: {self.name} | Автор: {self.author}'
@@ -98,3 +125,103 @@ class RecipeIngredient(models.Model):
             f'{self.recipe.name}: {self.ingredient.name} - '
             f'{self.amount} {self.ingredient.measurement_unit}'
         )
+
+
+class CartIngredient(models.Model):
+    """ Running total of an ingredient across a user's shopping cart.
+        Maintained incrementally by api.shopping_cart.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='Пользователь')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ингредиент')
+    total_amount = models.IntegerField(verbose_name='Общее количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient_constraint')
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.ingredient_id} - {self.total_amount}'
+
+
+class PrivateStorage(FileSystemStorage):
+    """ Storage outside MEDIA_ROOT, its files are served only by views.
+        The location follows PRIVATE_MEDIA_ROOT, even when overridden.
+    """
+    @property
+    def base_location(self):
+        return settings.PRIVATE_MEDIA_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def private_storage():
+    return PrivateStorage()
+
+
+class Job(models.Model):
+    """ Unit of deferred work, picked up by the run_workers command """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (SUCCEEDED, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    kind = models.CharField(max_length=100, verbose_name='Тип задачи')
+    payload = models.JSONField(default=dict, verbose_name='Параметры')
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        null=True, blank=True,
+        verbose_name='Пользователь')
+    status = models.CharField(
+        max_length=16, choices=STATUSES, default=PENDING,
+        verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveSmallIntegerField(
+        default=3, verbose_name='Максимум попыток')
+    run_after = models.DateTimeField(
+        default=timezone.now, verbose_name='Не раньше')
+    started_at = models.DateTimeField(
+        null=True, blank=True, verbose_name='Начало')
+    finished_at = models.DateTimeField(
+        null=True, blank=True, verbose_name='Окончание')
+    result = models.JSONField(null=True, blank=True, verbose_name='Результат')
+    result_file = models.FileField(
+        upload_to='jobs/', storage=private_storage, blank=True,
+        verbose_name='Файл результата')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(
+                fields=['status', 'run_after'], name='job_queue_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.kind} #{self.pk} ({self.status})'
@@ -0,0 +1,78 @@
+""" Shopping list PDF rendering with a content-addressed cache. """
+import hashlib
+import io
+import logging
+import os
+import time
+
+from django.core.cache import cache
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from api.exports import format_line
+from foodgram import metrics
+
+logger = logging.getLogger(__name__)
+
+FONT_NAME = 'DejaVuSans'
+FONT_PATH = os.path.join(os.path.dirname(__file__), 'DejaVuSans.ttf')
+FONT_SIZE = 14
+LEADING = 25
+LINES_PER_PAGE = int((A4[1] - 2 * inch) // LEADING)
+CACHE_PREFIX = 'shopping-list-pdf'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def register_font():
+    """ Registers a font supporting cyrillic alphabet, once per process """
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+
+
+def render(title, lines):
+    """ Renders the lines into a PDF, starting a new page when one is full """
+    register_font()
+    buf = io.BytesIO()
+    page = canvas.Canvas(buf, pagesize=A4, bottomup=0)
+    lines = [title, *lines]
+    for start in range(0, len(lines), LINES_PER_PAGE):
+        text_obj = page.beginText()
+        text_obj.setTextOrigin(inch, inch)
+        text_obj.setFont(FONT_NAME, FONT_SIZE)
+        text_obj.setLeading(leading=LEADING)
+        for line in lines[start:start + LINES_PER_PAGE]:
+            text_obj.textLine(line)
+        page.drawText(text_obj)
+        page.showPage()
+    page.save()
+    return buf.getvalue()
+
+
+def get_shopping_list(title, ingredients):
+    """ Returns the shopping list PDF as bytes.
+        Rendered documents are cached under a hash of their content,
+        so an unchanged cart is never rendered twice.
+    """
+    lines = [
+        format_line(num, row) for num, row in enumerate(ingredients, start=1)
+    ]
+    digest = hashlib.sha256(
+        '\n'.join([title, *lines]).encode()).hexdigest()
+    key = f'{CACHE_PREFIX}:{digest}'
+    document = cache.get(key)
+    if document is not None:
+        metrics.increment('pdf_cache_total', result='hit')
+        logger.info('Shopping list %s served from cache', digest)
+        return document
+    started = time.perf_counter()
+    document = render(title, lines)
+    elapsed = time.perf_counter() - started
+    metrics.increment('pdf_cache_total', result='miss')
+    metrics.observe('pdf_render_seconds', elapsed)
+    logger.info('Shopping list %s rendered in %.3fs (%d lines)',
+                digest, elapsed, len(lines))
+    cache.set(key, document, CACHE_TIMEOUT)
+    return document
@@ -0,0 +1,22 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class ExportRenderer(JSONRenderer):
+    """ Declares a file format that a view streams by itself.
+        Only error responses reach the renderer and are rendered as JSON.
+    """
+
+
+class PDFRenderer(ExportRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PlainTextRenderer(ExportRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
@@ -0,0 +1,50 @@
+""" Shared cache of anonymous recipe list responses.
+
+Entries are keyed on the normalised query string together with the version
+stamps the page depends on, so a change to a recipe only invalidates the
+pages that could contain it: the unfiltered ones and the ones filtered by
+one of its tags.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from api import versions
+from foodgram import metrics
+
+KEY_PREFIX = 'recipe-list'
+TIMEOUT = 60 * 5
+
+
+def _dependencies(request):
+    names = [versions.TAGS, versions.INGREDIENTS, versions.USERS]
+    tags = sorted(set(request.query_params.getlist('tags')))
+    if tags:
+        names.extend(versions.recipes_tag(slug) for slug in tags)
+    else:
+        names.append(versions.RECIPES)
+    return names
+
+
+def make_key(request):
+    params = sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists())
+    raw = json.dumps([
+        request.build_absolute_uri(request.path),
+        params,
+        versions.get_many(*_dependencies(request)),
+    ])
+    return f'{KEY_PREFIX}:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+
+def load(key):
+    data = cache.get(key)
+    metrics.increment(
+        'recipe_list_cache_total', result='miss' if data is None else 'hit')
+    return data
+
+
+def store(key, data):
+    cache.set(key, data, TIMEOUT)
@@ -0,0 +1,245 @@
+""" Synthetic data for benchmarks and local load testing.
+
+The dataset is skewed the way real usage is: a few ingredients and tags
+appear in most recipes, a few authors write most of the recipes and gather
+most of the followers, and a few recipes collect most favorites and cart
+additions. Popularity follows Zipf's law over a random ranking.
+
+Rows are written in batches, with COPY on PostgreSQL and bulk_create
+elsewhere. Bulk writes send no signals, so the shopping cart totals and the
+counters are rebuilt at the end.
+"""
+import io
+import random
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from api import counters, shopping_cart, versions
+from api.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import CustomUser, Follow
+
+PASSWORD = 'foodgram-seed'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#D2A875', 'dessert'),
+    ('Веган', '#7BC67E', 'vegan'),
+    ('Быстро', '#E0B33B', 'quick'),
+)
+DISHES = ('Суп', 'Салат', 'Пирог', 'Рагу', 'Омлет', 'Паста', 'Каша',
+          'Запеканка', 'Плов', 'Блины')
+ADJECTIVES = ('домашний', 'летний', 'острый', 'сырный', 'овощной',
+              'грибной', 'быстрый', 'праздничный', 'бабушкин', 'лёгкий')
+PLACEHOLDER_NAME = 'seed/placeholder.jpg'
+# Zipf exponents: the larger, the more the top items dominate
+INGREDIENT_SKEW = 1.0
+TAG_SKEW = 0.8
+AUTHOR_SKEW = 1.1
+RECIPE_SKEW = 1.0
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_value(value):
+    """ Field value as written by COPY ... WITH (FORMAT csv) """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    return '"{}"'.format(str(value).replace('"', '""'))
+
+
+def copy(model, columns, rows):
+    """ Writes `rows`, tuples of values for the `columns` attnames, with a
+        single COPY. The other fields get their default value.
+    """
+    opts = model._meta
+    now = timezone.now()
+    defaults = []
+    for field in opts.concrete_fields:
+        if field.primary_key or field.attname in columns:
+            continue
+        if getattr(field, 'auto_now', False) or getattr(
+                field, 'auto_now_add', False):
+            value = now
+        else:
+            value = field.get_default()
+        defaults.append(
+            (field.column, field.get_db_prep_save(value, connection)))
+    quote = connection.ops.quote_name
+    names = ', '.join(quote(name) for name in (
+        *(opts.get_field(column).column for column in columns),
+        *(column for column, _ in defaults)))
+    tail = ''.join(',' + csv_value(value) for _, value in defaults)
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(','.join(map(csv_value, row)) + tail + '\n')
+    buf.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {quote(opts.db_table)} ({names}) '
+            f'FROM STDIN WITH (FORMAT csv)', buf)
+
+
+def insert(model, columns, rows, batch_size, use_copy=True):
+    """ Inserts `rows` of `columns` values in batches, returns the primary
+        keys of the new rows
+    """
+    last_pk = model.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    use_copy = use_copy and connection.vendor == 'postgresql'
+    for batch in batches(rows, batch_size):
+        if use_copy:
+            copy(model, columns, batch)
+        else:
+            model.objects.bulk_create(
+                model(**dict(zip(columns, row))) for row in batch)
+    return list(model.objects.filter(pk__gt=last_pk).order_by(
+        'pk').values_list('pk', flat=True))
+
+
+class Popularity:
+    """ Zipf-distributed choice among `items` ranked in random order """
+    def __init__(self, items, skew, rng):
+        self.items = list(items)
+        self.rng = rng
+        ranks = list(range(1, len(self.items) + 1))
+        rng.shuffle(ranks)
+        self.cum_weights = list(accumulate(1 / rank ** skew for rank in ranks))
+
+    def choice(self):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights)[0]
+
+    def sample(self, k, exclude=None):
+        """ `k` distinct items, popular ones more likely """
+        k = min(k, len(self.items) - (exclude is not None))
+        if k > len(self.items) // 2:
+            # Rejection sampling would stall, draw without weights instead
+            return self.rng.sample(
+                [item for item in self.items if item != exclude], k)
+        chosen = set()
+        while len(chosen) < k:
+            chosen.update(self.rng.choices(
+                self.items, cum_weights=self.cum_weights, k=k - len(chosen)))
+            chosen.discard(exclude)
+        return list(chosen)
+
+
+def activity(rng, mean):
+    """ Exponentially distributed number of items with the given mean """
+    return int(rng.expovariate(1 / mean) + 0.5) if mean > 0 else 0
+
+
+def placeholder_image():
+    """ Stores one small image shared by all seeded recipes """
+    if not default_storage.exists(PLACEHOLDER_NAME):
+        buf = io.BytesIO()
+        Image.new('RGB', (640, 480), '#E26C2D').save(buf, 'JPEG')
+        default_storage.save(PLACEHOLDER_NAME, ContentFile(buf.getvalue()))
+    return PLACEHOLDER_NAME
+
+
+def ensure_ingredients():
+    if not Ingredient.objects.exists():
+        call_command('import_data', stdout=io.StringIO())
+    return list(Ingredient.objects.values_list('pk', flat=True))
+
+
+def ensure_tags():
+    for name, color, slug in TAGS:
+        Tag.objects.get_or_create(
+            slug=slug, defaults={'name': name, 'color': color})
+    return list(Tag.objects.values_list('pk', flat=True))
+
+
+@transaction.atomic
+def generate(users=200, recipes=2000, favorites=20, cart=5, follows=10,
+             seed=0, batch_size=1000, use_copy=True):
+    """ Generates users, recipes and the relations between them, with
+        `favorites`, `cart` and `follows` relations per user on average.
+        Returns {'users': [...], 'recipes': [...]} with the new pks.
+    """
+    rng = random.Random(seed)
+    ingredients = Popularity(ensure_ingredients(), INGREDIENT_SKEW, rng)
+    tags = Popularity(ensure_tags(), TAG_SKEW, rng)
+    image = placeholder_image()
+    password = make_password(PASSWORD)
+    offset = CustomUser.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    had_carts = Recipe.cart.through.objects.exists()
+
+    def write(model, columns, rows):
+        return insert(model, columns, rows, batch_size, use_copy)
+
+    user_ids = write(
+        CustomUser,
+        ('username', 'email', 'first_name', 'last_name', 'password'), (
+            (f'seed{number}', f'seed{number}@example.com', 'Имя',
+             f'Фамилия {number}', password)
+            for number in range(offset, offset + users)
+        ))
+    # Prolific authors are also the most followed ones
+    authors = Popularity(user_ids, AUTHOR_SKEW, rng)
+
+    recipe_ids = write(
+        Recipe, ('author_id', 'name', 'text', 'image', 'cooking_time'), (
+            (authors.choice(),
+             f'{rng.choice(DISHES)} {rng.choice(ADJECTIVES)}',
+             'Описание рецепта. ' * rng.randint(3, 30),
+             image, rng.randint(5, 180))
+            for _ in range(recipes)
+        ))
+    popular = Popularity(recipe_ids, RECIPE_SKEW, rng)
+
+    write(RecipeIngredient, ('recipe_id', 'ingredient_id', 'amount'), (
+        (recipe_id, ingredient_id, rng.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in ingredients.sample(rng.randint(3, 12))
+    ))
+    write(Recipe.tags.through, ('recipe_id', 'tag_id'), (
+        (recipe_id, tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in tags.sample(rng.randint(1, 3))
+    ))
+    for through, mean in ((Recipe.favorite.through, favorites),
+                          (Recipe.cart.through, cart)):
+        write(through, ('customuser_id', 'recipe_id'), (
+            (user_id, recipe_id)
+            for user_id in user_ids
+            for recipe_id in popular.sample(activity(rng, mean))
+        ))
+    write(Follow, ('user_id', 'author_id'), (
+        (user_id, author_id)
+        for user_id in user_ids
+        for author_id in authors.sample(
+            activity(rng, follows), exclude=user_id)
+    ))
+
+    # Bulk inserts send no signals: rebuild what they would maintain.
+    # Only the new users have carts to rebuild, in batches so that a large
+    # seed does not end up in one statement with millions of parameters.
+    if not had_carts:
+        shopping_cart.rebuild(batch_size=batch_size)
+    else:
+        for start in range(0, len(user_ids), batch_size):
+            shopping_cart.rebuild(
+                user_ids[start:start + batch_size], batch_size)
+    counters.recount()
+    versions.bump(versions.USERS, versions.RECIPES, *(
+        versions.recipes_tag(slug) for _, _, slug in TAGS))
+    return {'users': user_ids, 'recipes': recipe_ids}
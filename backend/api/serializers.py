@@ -1,8 +1,16 @@
+from collections import Counter
+
 from django.contrib.auth import password_validation
+from django.db import connection, transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers, validators
+from rest_framework.reverse import reverse
 
-from api.fields import Base64ImageField
-from api.models import Ingredient, Recipe, RecipeIngredient, Tag
+from api import counters, images, shopping_cart, versions
+from api.fields import (Base64ImageField, BulkPrimaryKeyRelatedField,
+                        ImageVariantsField, resolve_pks)
+from api.models import Ingredient, Job, Recipe, RecipeIngredient, Tag
+from api.viewer import ViewerContext
 from users.models import CustomUser, Follow
 
 
@@ -75,10 +83,8 @@ class GetUserSerializer(serializers.ModelSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return Follow.objects.filter(user=user, author=obj).exists()
-        return False
+        viewer = ViewerContext.for_request(self.context.get('request'))
+        return viewer.is_subscribed(obj)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -108,7 +114,7 @@ class GetRecipeIngredientSerializer(serializers.ModelSerializer):
 
 class AddRecipeIngredientSerializer(serializers.ModelSerializer):
     """ Serializer for RecipeIngredient model """
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -122,25 +128,27 @@ class GetRecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     tags = TagSerializer(many=True, read_only=True)
-    ingredients = serializers.SerializerMethodField()
+    ingredients = GetRecipeIngredientSerializer(
+        source='ingredient_amount', many=True, read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'author', 'name', 'image', 'text',
+        fields = ('id', 'author', 'name', 'image', 'image_variants', 'text',
                   'ingredients', 'tags', 'cooking_time', 'is_favorited',
                   'is_in_shopping_cart')
 
-    def get_ingredients(self, obj):
-        ingredients = RecipeIngredient.objects.filter(recipe=obj)
-        return GetRecipeIngredientSerializer(ingredients, many=True).data
-
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_authenticated:
             return user.favorites.filter(id=obj.id).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_authenticated:
             return user.shopping_cart.filter(id=obj.id).exists()
@@ -149,30 +157,58 @@ class GetRecipeSerializer(serializers.ModelSerializer):
 
 class FavoriteRecipeSerializer(serializers.ModelSerializer):
     """ Shortened serializer to view favorite recipes """
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class CreateOrUpdateRecipeSerialzer(serializers.ModelSerializer):
     """ Serializer for creating a new recipe """
     ingredients = AddRecipeIngredientSerializer(many=True)
     image = Base64ImageField(max_length=None, use_url=True)
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True)
 
     class Meta:
         model = Recipe
         fields = ('name', 'image', 'text',
                   'ingredients', 'tags', 'cooking_time')
 
-    def _add_ingredients(self, recipe, ingredients):
-        for ingredient in ingredients:
-            RecipeIngredient.objects.get_or_create(
-                recipe=recipe,
-                ingredient=ingredient['id'],
-                amount=ingredient['amount'],
-            )
+    def _set_ingredients(self, recipe, ingredients, existing=()):
+        """ Brings the recipe's `existing` RecipeIngredient rows in line
+            with `ingredients`: one delete, one update and one insert at most
+        """
+        current = {row.ingredient_id: row for row in existing}
+        to_create, to_update = [], []
+        for item in ingredients:
+            row = current.pop(item['id'].id, None)
+            if row is None:
+                to_create.append(RecipeIngredient(
+                    recipe=recipe,
+                    ingredient=item['id'],
+                    amount=item['amount'],
+                ))
+            elif row.amount != item['amount']:
+                row.amount = item['amount']
+                to_update.append(row)
+        if current:
+            RecipeIngredient.objects.filter(
+                id__in=[row.id for row in current.values()]).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+
+    def validate_ingredients(self, value):
+        """ Resolves all ingredient ids with a single query """
+        ingredients = resolve_pks(
+            Ingredient.objects.all(),
+            [item['id'] for item in value],
+            self.context.get('known_objects', {}).get(Ingredient))
+        for item, ingredient in zip(value, ingredients):
+            item['id'] = ingredient
+        return value
 
     def _check_for_duplicate_tags(self, data):
         """ Checks if the same tag is added twice """
@@ -199,26 +235,87 @@ class CreateOrUpdateRecipeSerialzer(serializers.ModelSerializer):
         return data
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                'ingredient_amount',
+                queryset=RecipeIngredient.objects.select_related('ingredient'),
+            ),
+            'tags',
+        )
         serializer = GetRecipeSerializer(
             instance, context=self.context)
         return serializer.data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
-        self._add_ingredients(recipe, ingredients)
-        recipe.save()
+        self._set_ingredients(recipe, ingredients)
+        images.schedule(recipe)
         return recipe
 
+    @classmethod
+    @transaction.atomic
+    def bulk_create(cls, items, **extra):
+        """ Inserts many validated recipes with a few batched queries """
+        recipes = [
+            Recipe(**{
+                field: value for field, value in data.items()
+                if field not in ('ingredients', 'tags')
+            }, **extra)
+            for data in items
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            recipes = Recipe.objects.bulk_create(recipes)
+            # Bulk inserts send no signals
+            for author_id, created in Counter(
+                    recipe.author_id for recipe in recipes).items():
+                counters.change(
+                    CustomUser.objects.filter(pk=author_id), 'recipes_count',
+                    created)
+        else:
+            # save() counts each recipe through its post_save receiver
+            for recipe in recipes:
+                recipe.save()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient=item['id'], amount=item['amount'])
+            for recipe, data in zip(recipes, items)
+            for item in data['ingredients']
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe, data in zip(recipes, items)
+            for tag in data['tags']
+        )
+        images.schedule(*recipes)
+        versions.bump(versions.RECIPES, *{
+            versions.recipes_tag(tag.slug)
+            for data in items for tag in data['tags']
+        })
+        return recipes
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        RecipeIngredient.objects.filter(recipe=instance).delete()
+        old_image = instance.image.name
+        existing = list(RecipeIngredient.objects.filter(recipe=instance))
+        old_amounts = {row.ingredient_id: row.amount for row in existing}
         instance.tags.set(tags)
-        self._add_ingredients(instance, ingredients)
-        return super().update(instance, validated_data)
+        with shopping_cart.untracked():
+            self._set_ingredients(instance, ingredients, existing)
+        shopping_cart.update_recipe(instance, old_amounts, {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        })
+        instance = super().update(instance, validated_data)
+        if instance.image.name != old_image:
+            images.schedule(instance)
+        return instance
 
 
 class ShortUserSerilazier(serializers.ModelSerializer):
@@ -230,8 +327,7 @@ class ShortUserSerilazier(serializers.ModelSerializer):
 class FollowSerializer(serializers.ModelSerializer):
     """ Serializer for subscriptions page """
     is_subscribed = serializers.SerializerMethodField(read_only=True)
-    recipes = FavoriteRecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = CustomUser
@@ -247,26 +343,25 @@ class FollowSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if not user:
-            return False
-        return Follow.objects.filter(user=user, author=obj).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        viewer = ViewerContext.for_request(self.context.get('request'))
+        return viewer.is_subscribed(obj)
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit_recipes = request.query_params.get('recipes_limit')
-        if limit_recipes is not None:
-            recipes = obj.recipes.all()[:(int(limit_recipes))]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
         else:
-            recipes = obj.recipes.all()
+            limit_recipes = request.query_params.get('recipes_limit')
+            if limit_recipes is not None:
+                recipes = obj.recipes.all()[:(int(limit_recipes))]
+            else:
+                recipes = obj.recipes.all()
         context = {'request': request}
         return FavoriteRecipeSerializer(recipes, many=True,
                                         context=context).data
 
-    @staticmethod
-    def get_recipes_count(obj):
-        return obj.recipes.count()
-
 
 class SubscribeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -278,3 +373,20 @@ class SubscribeSerializer(serializers.ModelSerializer):
                 fields=['user', 'author']
             )
         ]
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """ Status of a background job, with a link to its file once done """
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ('id', 'kind', 'status', 'attempts', 'result', 'download',
+                  'created_at', 'finished_at')
+
+    def get_download(self, obj):
+        if obj.status != Job.SUCCEEDED or not obj.result_file:
+            return None
+        return reverse(
+            'jobs-download', args=(obj.pk,),
+            request=self.context.get('request'))
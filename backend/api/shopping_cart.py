@@ -0,0 +1,159 @@
+""" Incremental maintenance of the per-user CartIngredient totals.
+
+Every change to a shopping cart or to the ingredients of a recipe that sits
+in somebody's cart is turned into a set of per-ingredient deltas, which are
+applied to the affected users with a constant number of queries.
+
+Bulk changes made by the API are accounted for explicitly with
+update_recipe() inside untracked(). Any other save or delete of a single
+RecipeIngredient row, e.g. in the admin, reaches change_ingredient()
+through the signal receivers in api.signals.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from api.models import CartIngredient, Recipe, RecipeIngredient
+
+CartItem = Recipe.cart.through
+
+_untracked = ContextVar('untracked_recipe_ingredients', default=False)
+
+
+@contextmanager
+def untracked():
+    """ RecipeIngredient rows saved or deleted inside are skipped by the
+        signal receivers, the caller accounts for them itself
+    """
+    token = _untracked.set(True)
+    try:
+        yield
+    finally:
+        _untracked.reset(token)
+
+
+def is_tracked():
+    return not _untracked.get()
+
+
+def items(user_id):
+    """ (name, measurement_unit, total_amount) rows of a user's cart """
+    return CartIngredient.objects.filter(user=user_id).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount',
+    ).order_by('ingredient__name')
+
+
+def recipe_amounts(recipe_ids):
+    """ Returns {ingredient_id: amount} summed over the given recipes """
+    return dict(
+        RecipeIngredient.objects.filter(recipe__in=recipe_ids)
+        .values('ingredient')
+        .annotate(total=Sum('amount'))
+        .values_list('ingredient', 'total')
+    )
+
+
+def apply_deltas(user_ids, deltas):
+    """ Adds `deltas` ({ingredient_id: amount}) to the cart totals
+        of every user in `user_ids`.
+
+        A single INSERT ... ON CONFLICT DO UPDATE creates or changes the
+        rows, so concurrent changes of the same cart cannot both insert a
+        missing row. Rows are written in key order to avoid deadlocks.
+    """
+    user_ids = sorted(set(user_ids))
+    deltas = {
+        ingredient_id: amount
+        for ingredient_id, amount in deltas.items() if amount
+    }
+    if not user_ids or not deltas:
+        return
+    opts = CartIngredient._meta
+    quote = connection.ops.quote_name
+    table = quote(opts.db_table)
+    user, ingredient, total = (
+        quote(opts.get_field(name).column)
+        for name in ('user', 'ingredient', 'total_amount'))
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({user}, {ingredient}, {total}) '
+                f'SELECT users.id, deltas.ingredient_id, deltas.amount '
+                f'FROM unnest(%s::bigint[]) AS users(id) '
+                f'CROSS JOIN unnest(%s::bigint[], %s::integer[]) '
+                f'AS deltas(ingredient_id, amount) '
+                f'ORDER BY 1, 2 '
+                f'ON CONFLICT ({user}, {ingredient}) DO UPDATE '
+                f'SET {total} = {table}.{total} + EXCLUDED.{total}',
+                [user_ids, list(deltas), list(deltas.values())])
+        CartIngredient.objects.filter(
+            user__in=user_ids, ingredient__in=deltas,
+            total_amount__lte=0).delete()
+
+
+def add_recipes(user_ids, recipe_ids):
+    """ Recipes `recipe_ids` were added to the carts of `user_ids` """
+    apply_deltas(user_ids, recipe_amounts(recipe_ids))
+
+
+def remove_recipes(user_ids, recipe_ids):
+    """ Recipes `recipe_ids` were removed from the carts of `user_ids` """
+    apply_deltas(user_ids, {
+        ingredient_id: -amount
+        for ingredient_id, amount in recipe_amounts(recipe_ids).items()
+    })
+
+
+def update_recipe(recipe, old_amounts, new_amounts):
+    """ Applies the difference between two {ingredient_id: amount} states
+        of `recipe` to everyone who has it in the cart
+    """
+    deltas = {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0))
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    if not any(deltas.values()):
+        return
+    user_ids = CartItem.objects.filter(recipe=recipe).values_list(
+        'customuser', flat=True)
+    apply_deltas(user_ids, deltas)
+
+
+def change_ingredient(recipe_id, ingredient_id, delta):
+    """ The amount of one ingredient of a recipe changed by `delta` """
+    if not delta:
+        return
+    user_ids = CartItem.objects.filter(recipe=recipe_id).values_list(
+        'customuser', flat=True)
+    apply_deltas(user_ids, {ingredient_id: delta})
+
+
+def rebuild(user_ids=None, batch_size=1000):
+    """ Recomputes CartIngredient from scratch, for everyone by default """
+    stale = CartIngredient.objects.all()
+    if user_ids is None:
+        totals = RecipeIngredient.objects.filter(recipe__cart__isnull=False)
+    else:
+        totals = RecipeIngredient.objects.filter(recipe__cart__in=user_ids)
+        stale = stale.filter(user__in=user_ids)
+    totals = totals.values('recipe__cart', 'ingredient').annotate(
+        total=Sum('amount')).values_list('recipe__cart', 'ingredient', 'total')
+    rows = (
+        CartIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, total_amount=total)
+        for user_id, ingredient_id, total in totals.iterator()
+    )
+    with transaction.atomic():
+        stale.delete()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            CartIngredient.objects.bulk_create(batch)
@@ -0,0 +1,235 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api import counters, shopping_cart, versions
+from api.models import Ingredient, Job, Recipe, RecipeIngredient, Tag
+from users.models import CustomUser, Follow
+
+CartItem = Recipe.cart.through
+FavoriteItem = Recipe.favorite.through
+RecipeTag = Recipe.tags.through
+
+
+def changed_pks(sender, instance, action, reverse, pk_set):
+    """ Primary keys on the other side of a Recipe.cart or Recipe.favorite
+        change that are actually added or removed, None for other actions
+    """
+    if action == 'post_add':
+        return pk_set
+    if action not in ('pre_remove', 'pre_clear'):
+        return None
+    own, other = ('customuser', 'recipe') if reverse else (
+        'recipe', 'customuser')
+    rows = sender.objects.filter(**{own: instance})
+    if action == 'pre_remove':
+        rows = rows.filter(**{f'{other}__in': pk_set})
+    return list(rows.values_list(other, flat=True))
+
+
+@receiver(m2m_changed, sender=CartItem)
+def update_cart_totals(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Keeps CartIngredient in sync with Recipe.cart, from either side """
+    changed = changed_pks(sender, instance, action, reverse, pk_set)
+    if not changed:
+        return
+    if reverse:
+        user_ids, recipe_ids = [instance.pk], changed
+    else:
+        user_ids, recipe_ids = changed, [instance.pk]
+    if action == 'post_add':
+        shopping_cart.add_recipes(user_ids, recipe_ids)
+    else:
+        shopping_cart.remove_recipes(user_ids, recipe_ids)
+
+
+@receiver(m2m_changed, sender=CartItem)
+@receiver(m2m_changed, sender=FavoriteItem)
+def update_recipe_counters(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """ Keeps Recipe.in_carts_count and Recipe.favorites_count in sync
+        with Recipe.cart and Recipe.favorite, from either side
+    """
+    changed = changed_pks(sender, instance, action, reverse, pk_set)
+    if not changed:
+        return
+    field = 'in_carts_count' if sender is CartItem else 'favorites_count'
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        counters.change(Recipe.objects.filter(pk__in=changed), field, delta)
+    else:
+        counters.change(
+            Recipe.objects.filter(pk=instance.pk), field,
+            delta * len(changed))
+
+
+@receiver(pre_delete, sender=CustomUser)
+def uncount_deleted_user(sender, instance, **kwargs):
+    """ Favorites and cart rows of a deleted user are cascaded
+        without m2m signals
+    """
+    for through, field in ((FavoriteItem, 'favorites_count'),
+                           (CartItem, 'in_carts_count')):
+        counters.change(
+            Recipe.objects.filter(
+                pk__in=through.objects.filter(
+                    customuser=instance).values('recipe')),
+            field, -1)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def count_author_recipes(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    counters.change(
+        CustomUser.objects.filter(pk=instance.author_id), 'recipes_count',
+        1 if created else -1)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def count_followers(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    counters.change(
+        CustomUser.objects.filter(pk=instance.author_id), 'followers_count',
+        1 if created else -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_deleted_recipe_from_carts(sender, instance, **kwargs):
+    """ Cart rows of a deleted recipe are cascaded without m2m signals """
+    user_ids = list(CartItem.objects.filter(recipe=instance).values_list(
+        'customuser', flat=True))
+    shopping_cart.remove_recipes(user_ids, [instance.pk])
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, raw=False, **kwargs):
+    """ Keeps the stored state of a row about to be changed """
+    instance.stored_state = None
+    if instance.pk and not raw and shopping_cart.is_tracked():
+        instance.stored_state = sender.objects.filter(
+            pk=instance.pk).values_list(
+                'recipe', 'ingredient', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_cart_totals_on_save(sender, instance, raw=False, **kwargs):
+    """ Single row edits outside the API, e.g. in the admin """
+    if raw or not shopping_cart.is_tracked():
+        return
+    amount = instance.amount
+    stored = getattr(instance, 'stored_state', None)
+    if stored is not None:
+        recipe_id, ingredient_id, stored_amount = stored
+        if (recipe_id, ingredient_id) == (
+                instance.recipe_id, instance.ingredient_id):
+            amount -= stored_amount
+        else:
+            shopping_cart.change_ingredient(
+                recipe_id, ingredient_id, -stored_amount)
+    shopping_cart.change_ingredient(
+        instance.recipe_id, instance.ingredient_id, amount)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def update_cart_totals_on_delete(sender, instance, **kwargs):
+    if shopping_cart.is_tracked():
+        shopping_cart.change_ingredient(
+            instance.recipe_id, instance.ingredient_id, -instance.amount)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def touch_recipe(sender, instance, raw=False, **kwargs):
+    """ Single row edits outside the API change the recipe they belong to,
+        the API saves the recipe itself
+    """
+    if raw or not shopping_cart.is_tracked():
+        return
+    recipe_ids = {instance.recipe_id}
+    stored = getattr(instance, 'stored_state', None)
+    if stored is not None:
+        recipe_ids.add(stored[0])
+    Recipe.objects.filter(pk__in=recipe_ids).update(updated_at=timezone.now())
+    bump_recipe_lists(Tag.objects.filter(
+        recipe__in=recipe_ids).values_list('slug', flat=True).distinct())
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    versions.bump(versions.INGREDIENTS)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    versions.bump(versions.TAGS)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def bump_users_version(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    versions.bump(versions.USERS)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follower_version(sender, instance, **kwargs):
+    versions.bump(versions.viewer(instance.user_id))
+
+
+@receiver(m2m_changed, sender=CartItem)
+@receiver(m2m_changed, sender=FavoriteItem)
+def bump_viewer_versions(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """ Favorites and cart are part of what a user sees on every recipe """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = sender.objects.filter(recipe=instance).values_list(
+            'customuser', flat=True)
+    else:
+        user_ids = pk_set
+    versions.bump(*(versions.viewer(user_id) for user_id in user_ids))
+
+
+def bump_recipe_lists(tag_slugs):
+    versions.bump(versions.RECIPES, *map(versions.recipes_tag, tag_slugs))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(pre_delete, sender=Recipe)
+def bump_recipe_versions(sender, instance, **kwargs):
+    bump_recipe_lists(instance.tags.values_list('slug', flat=True))
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+def bump_recipe_tag_versions(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        bump_recipe_lists([instance.slug])
+    elif action == 'pre_clear':
+        bump_recipe_lists(instance.tags.values_list('slug', flat=True))
+    else:
+        bump_recipe_lists(Tag.objects.filter(pk__in=pk_set).values_list(
+            'slug', flat=True))
+
+
+@receiver(post_delete, sender=Job)
+def delete_job_file(sender, instance, **kwargs):
+    """ Removes the result file once the job row is gone for good """
+    if instance.result_file:
+        file = instance.result_file
+        transaction.on_commit(lambda: file.delete(save=False))
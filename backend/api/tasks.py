@@ -0,0 +1,30 @@
+""" Handlers of the background job kinds, see api.jobs """
+from django.core.files.base import ContentFile
+
+from api import images, pdf, shopping_cart
+from api.jobs import task
+
+
+def shopping_list_title(user):
+    return f'Список покупок {user.username}:'
+
+
+@task('shopping_list_pdf')
+def render_shopping_list(job):
+    """ Renders the job owner's shopping list into `result_file` """
+    ingredients = list(shopping_cart.items(job.user_id))
+    document = pdf.get_shopping_list(
+        shopping_list_title(job.user), ingredients)
+    job.result_file.save(
+        f'shopping-list-{job.pk}.pdf', ContentFile(document), save=False)
+    return {'lines': len(ingredients)}
+
+
+@task('image_variants')
+def generate_image_variants(job):
+    """ Generates the variants of a photo shared by recipes """
+    payload = job.payload
+    # Jobs queued before photos were grouped carry a single recipe_id
+    recipe_ids = payload.get('recipe_ids') or [payload['recipe_id']]
+    return images.process(
+        payload['image'], recipe_ids, payload.get('force', False))
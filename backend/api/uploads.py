@@ -0,0 +1,50 @@
+""" Limits and header checks for uploaded recipe photos. """
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image, UnidentifiedImageError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Accepted Pillow formats and the extension they are stored with. Pillow
+# reads many phone camera photos as MPO, a JPEG with extra frames appended.
+FORMATS = {
+    'JPEG': 'jpg', 'MPO': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Image is too large.'
+    default_code = 'image_too_large'
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """ Streams uploaded files into temporary files instead of memory,
+        giving up as soon as the request or a file exceeds the size limit
+    """
+    def handle_raw_input(self, input_data, meta, content_length, boundary,
+                         encoding=None):
+        limit = (settings.IMAGE_UPLOAD_MAX_SIZE
+                 + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0))
+        if content_length > limit:
+            raise ImageTooLarge()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.upload_interrupted()
+            raise ImageTooLarge()
+        return super().receive_data_chunk(raw_data, start)
+
+
+def read_header(file):
+    """ Returns (format, width, height) read from the image header alone,
+        None if the file is not an image Pillow recognizes
+    """
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+            return image.format, width, height
+    except (UnidentifiedImageError, OSError):
+        return None
+    finally:
+        file.seek(0)
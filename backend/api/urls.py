@@ -8,6 +8,7 @@ router.register('users', views.CustomUserViewSet)
 router.register('recipes', views.RecipeViewSet)
 router.register('tags', views.TagViewSet, basename='Tag')
 router.register('ingredients', views.IngredientViewSet, basename='Ingredient')
+router.register('jobs', views.JobViewSet, basename='jobs')
 
 urlpatterns = [
     path('', include(router.urls)),
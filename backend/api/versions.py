@@ -0,0 +1,72 @@
+""" Shared version stamps for conditional GET and per-process caches.
+
+A version is the timestamp of the last change of a named resource, kept in
+the `versions` cache, which every worker shares and which is never culled.
+A missing stamp (first use or a cleared cache) is recreated as "now",
+which can only invalidate, never serve a stale response.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import caches
+from django.db import transaction
+
+CACHE = 'versions'
+KEY_PREFIX = 'version'
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+USERS = 'users'
+RECIPES = 'recipes'
+
+
+def viewer(user_id):
+    """ Relationships of one user: follows, favorites and shopping cart """
+    return f'viewer:{user_id}'
+
+
+def recipes_tag(slug):
+    """ Recipes carrying the tag """
+    return f'recipes:tag:{slug}'
+
+
+def get(name):
+    cache = caches[CACHE]
+    key = f'{KEY_PREFIX}:{name}'
+    version = cache.get(key)
+    if version is None:
+        version = time.time()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_many(*names):
+    keys = {f'{KEY_PREFIX}:{name}': name for name in names}
+    found = caches[CACHE].get_many(keys)
+    return [
+        found[key] if key in found else get(name)
+        for key, name in keys.items()
+    ]
+
+
+def bump(*names):
+    """ Marks the named resources as changed once the transaction commits """
+    def _bump():
+        now = time.time()
+        caches[CACHE].set_many(
+            {f'{KEY_PREFIX}:{name}': now for name in names}, None)
+    transaction.on_commit(_bump)
+
+
+def token(*names):
+    """ Opaque string that changes whenever one of the named versions does """
+    return '-'.join(f'{version:.6f}' for version in get_many(*names))
+
+
+def etag(*names):
+    """ Weak ETag for a representation depending on the named versions """
+    return f'W/"{token(*names)}"'
+
+
+def last_modified(*names):
+    return datetime.fromtimestamp(max(get_many(*names)), tz=timezone.utc)
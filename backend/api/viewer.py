@@ -0,0 +1,33 @@
+from users.models import Follow
+
+
+class ViewerContext:
+    """ Relationships of the requesting user, loaded once per request
+        and shared by every serializer that receives the same request.
+    """
+    def __init__(self, user):
+        self.user = user
+        self._followed_author_ids = None
+
+    @classmethod
+    def for_request(cls, request):
+        viewer = getattr(request, '_viewer_context', None)
+        if viewer is None:
+            viewer = cls(request.user)
+            request._viewer_context = viewer
+        return viewer
+
+    @property
+    def followed_author_ids(self):
+        """ Ids of all authors the user follows, a single query """
+        if self._followed_author_ids is None:
+            if self.user.is_authenticated:
+                self._followed_author_ids = set(
+                    Follow.objects.filter(user=self.user).values_list(
+                        'author_id', flat=True))
+            else:
+                self._followed_author_ids = set()
+        return self._followed_author_ids
+
+    def is_subscribed(self, author):
+        return author.id in self.followed_author_ids
@@ -1,32 +1,62 @@
 import io
+import os
 
-from django.db.models import Sum
-from django.http import FileResponse
+from django.conf import settings
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
-from rest_framework import permissions, status
+from rest_framework import mixins, permissions, status
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.reverse import reverse
+from rest_framework.viewsets import (GenericViewSet, ModelViewSet,
+                                     ReadOnlyModelViewSet)
 
+from api import (exports, ingredient_index, jobs, pdf, response_cache,
+                 shopping_cart, tasks, uploads, versions)
+from api.fields import parse_pk
 from api.filters import IngredientFilter, RecipeFilter
-from api.models import Ingredient, Recipe, Tag
+from api.models import Ingredient, Job, Recipe, RecipeIngredient, Tag
 from api.permissions import IsAuthorOrReadOnly, IsUserOrReadOnly
+from api.renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
 from api.serializers import (
     ChangePasswordSerializer, CreateOrUpdateRecipeSerialzer,
     FavoriteRecipeSerializer, FollowSerializer, GetRecipeSerializer,
-    IngredientSerializer, SubscribeSerializer, TagSerializer)
-from foodgram.pagination import LimitPageNumberPaginator
+    IngredientSerializer, JobSerializer, SubscribeSerializer, TagSerializer)
+from foodgram.pagination import LimitCursorPaginator, LimitPageNumberPaginator
 from users.models import CustomUser, Follow
 
 
+def tags_etag(request, *args, **kwargs):
+    return versions.etag(versions.TAGS)
+
+
+def ingredients_etag(request, *args, **kwargs):
+    return versions.etag(versions.INGREDIENTS)
+
+
+def recipe_last_modified(request, pk):
+    """ A recipe changes with its own row, the catalogs it refers to,
+        its author and the relations of the viewer to it
+    """
+    updated_at = Recipe.objects.filter(pk=pk).values_list(
+        'updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    names = [versions.TAGS, versions.INGREDIENTS, versions.USERS]
+    if request.user.is_authenticated:
+        names.append(versions.viewer(request.user.id))
+    return max(updated_at, versions.last_modified(*names))
+
+
 class CustomUserViewSet(UserViewSet):
     """Viewset for all user-related operations. Uses djoser endpoints"""
     @action(methods=('post',),
@@ -67,14 +97,59 @@ class CustomUserViewSet(UserViewSet):
                 {'detail': 'subscription doesn\'t exist'},
                 status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def _get_recipes_limit(request):
+        """ Returns a positive 'recipes_limit' query param or None """
+        try:
+            limit = int(request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit > 0 else None
+
+    @staticmethod
+    def _attach_latest_recipes(authors, limit):
+        """ Loads up to `limit` newest recipes of every author in one query
+            and stores them on the author as `latest_recipes`
+        """
+        author_ids = [author.id for author in authors]
+        if not author_ids:
+            return
+        if limit is None:
+            recipes = Recipe.objects.filter(author__in=author_ids).only(
+                'id', 'author_id', 'name', 'image', 'image_variants',
+                'cooking_time',
+            ).order_by('-id')
+        else:
+            table = Recipe._meta.db_table
+            placeholders = ', '.join(['%s'] * len(author_ids))
+            recipes = Recipe.objects.raw(
+                f'SELECT id, author_id, name, image, image_variants, '
+                f'cooking_time FROM ('
+                f'SELECT id, author_id, name, image, image_variants, '
+                f'cooking_time, '
+                f'ROW_NUMBER() OVER ('
+                f'PARTITION BY author_id ORDER BY id DESC) AS recipe_rank '
+                f'FROM {table} WHERE author_id IN ({placeholders})'
+                f') AS ranked WHERE recipe_rank <= %s ORDER BY id DESC',
+                [*author_ids, limit],
+            )
+        latest_recipes = {author_id: [] for author_id in author_ids}
+        for recipe in recipes:
+            latest_recipes[recipe.author_id].append(recipe)
+        for author in authors:
+            author.latest_recipes = latest_recipes[author.id]
+
     @action(detail=False, permission_classes=[permissions.IsAuthenticated])
     def subscriptions(self, request):
         """ Returns a list of all user subscriptions,
             including their recipes
         """
         user = request.user
-        queryset = CustomUser.objects.filter(following__user=user)
+        queryset = CustomUser.objects.filter(following__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id')
         pages = self.paginate_queryset(queryset)
+        self._attach_latest_recipes(pages, self._get_recipes_limit(request))
         serializer = FollowSerializer(
             pages,
             many=True,
@@ -92,6 +167,68 @@ class RecipeViewSet(ModelViewSet):
     ordering = ('-id')
     pagination_class = LimitPageNumberPaginator
     http_method_names = ('get', 'post', 'delete', 'patch')
+    parser_classes = (JSONParser, MultiPartParser)
+
+    def initialize_request(self, request, *args, **kwargs):
+        """ Multipart photos are streamed to temporary files """
+        request.upload_handlers = [
+            uploads.LimitedTemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            Prefetch(
+                'ingredient_amount',
+                queryset=RecipeIngredient.objects.select_related('ingredient'),
+            ),
+            'tags',
+        )
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        favorites = Recipe.favorite.through.objects.filter(
+            recipe=OuterRef('pk'), customuser=user)
+        cart = Recipe.cart.through.objects.filter(
+            recipe=OuterRef('pk'), customuser=user)
+        return queryset.annotate(
+            is_favorited=Exists(favorites),
+            is_in_shopping_cart=Exists(cart),
+        )
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if LimitCursorPaginator.is_requested(self.request):
+                self._paginator = LimitCursorPaginator()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_count_version(self):
+        """ Page counts change with recipes and the viewer's relations """
+        names = [versions.RECIPES]
+        if self.request.user.is_authenticated:
+            names.append(versions.viewer(self.request.user.id))
+        return versions.token(*names)
+
+    def list(self, request, *args, **kwargs):
+        """ Anonymous pages are served from the shared response cache """
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        key = response_cache.make_key(request)
+        data = response_cache.load(key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+        response = super().list(request, *args, **kwargs)
+        response_cache.store(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    @method_decorator(condition(last_modified_func=recipe_last_modified))
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        patch_vary_headers(response, ('Authorization',))
+        return response
 
     def get_serializer_class(self):
         if self.request.method == 'POST' or self.request.method == 'PATCH':
@@ -101,6 +238,77 @@ class RecipeViewSet(ModelViewSet):
     def perform_create(self, serializer):
         return serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        # The recipe's pre_delete receiver takes it out of every cart, the
+        # cascaded ingredient rows need no tracking of their own
+        with shopping_cart.untracked():
+            instance.delete()
+
+    def _load_referenced(self, items):
+        """ Loads every ingredient and tag the items refer to, a query each """
+        ingredient_ids, tag_ids = set(), set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            for ingredient in item.get('ingredients') or ():
+                if isinstance(ingredient, dict):
+                    ingredient_ids.add(
+                        parse_pk(Ingredient, ingredient.get('id')))
+            for tag in item.get('tags') or ():
+                tag_ids.add(parse_pk(Tag, tag))
+        ingredient_ids.discard(None)
+        tag_ids.discard(None)
+        return {
+            Ingredient: Ingredient.objects.in_bulk(ingredient_ids),
+            Tag: Tag.objects.in_bulk(tag_ids),
+        }
+
+    @action(methods=('post',), detail=False, url_path='bulk')
+    def bulk_create(self, request):
+        """ Creates a list of recipes in one request.
+            Valid items are saved even if others fail, every item gets
+            its own result in the response. At most RECIPE_BULK_CREATE_LIMIT
+            recipes and RECIPE_BULK_MAX_BODY_SIZE bytes are accepted per
+            call; an `image` may name a photo stored earlier instead of
+            carrying it inline.
+        """
+        if (int(request.META.get('CONTENT_LENGTH') or 0)
+                > settings.RECIPE_BULK_MAX_BODY_SIZE):
+            return Response(
+                {'detail': f'The request must not exceed '
+                           f'{settings.RECIPE_BULK_MAX_BODY_SIZE} bytes.'},
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'detail': 'Expected a non-empty list of recipes.'},
+                status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.RECIPE_BULK_CREATE_LIMIT:
+            return Response(
+                {'detail': f'At most {settings.RECIPE_BULK_CREATE_LIMIT} '
+                           f'recipes can be created at once.'},
+                status.HTTP_400_BAD_REQUEST)
+        context = self.get_serializer_context()
+        context['known_objects'] = self._load_referenced(items)
+        results, valid = [], []
+        for index, item in enumerate(items):
+            serializer = CreateOrUpdateRecipeSerialzer(
+                data=item, context=context)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results.append({'index': index, 'errors': serializer.errors})
+        recipes = CreateOrUpdateRecipeSerialzer.bulk_create(
+            [data for _, data in valid], author=request.user)
+        results.extend(
+            {'index': index, 'id': recipe.id}
+            for (index, _), recipe in zip(valid, recipes))
+        results.sort(key=lambda result: result['index'])
+        return Response(
+            {'created': len(recipes), 'results': results},
+            status.HTTP_201_CREATED if len(recipes) == len(items)
+            else status.HTTP_207_MULTI_STATUS)
+
     def add_recipe_to_fav_or_cart(self, recipe, serializer, request):
         if request.method == 'POST':
             recipe.add(request.user)
@@ -128,37 +336,38 @@ class RecipeViewSet(ModelViewSet):
 
     @action(methods=('get',),
             permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=(JSONRenderer, PDFRenderer,
+                              CSVRenderer, PlainTextRenderer),
             detail=False)
     def download_shopping_cart(self, request):
-        """ Downloads a PDF list of all ingredients for recipes in cart """
-        ingredients = CustomUser.objects.filter(id=request.user.id).values(
-            'shopping_cart__ingredients__name',
-            'shopping_cart__ingredients__measurement_unit').annotate(
-            total=Sum('shopping_cart__ingredients__ingredient_amount__amount'),
-        ).order_by('shopping_cart__ingredients__name')
-
-        # Adding font supporting cyrillic alphabet
-        pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
-        # Generating PDF file with reportlab
-        buf = io.BytesIO()
-        page = canvas.Canvas(buf, pagesize=A4, bottomup=0)
-        text_obj = page.beginText()
-        text_obj.setTextOrigin(inch, inch)
-        text_obj.setFont('DejaVuSans', 14)
-        text_obj.setLeading(leading=25)
-        text_obj.textLine(f'Список покупок {request.user.username}:')
-        ingredient_num = 0
-        for i in ingredients:
-            ingredient_num += 1
-            text_obj.textLine(
-                f'{ingredient_num}. ' + ' '.join(str(i) for i in i.values()))
-
-        page.drawText(text_obj)
-        page.showPage()
-        page.save()
-        buf.seek(0)
-
-        return FileResponse(buf, as_attachment=True,
+        """ Downloads a list of all ingredients for recipes in cart.
+            PDF by default, '?format=' can be one of csv, txt or json.
+            With '?async=1' the PDF is rendered by a background job and
+            the response is 202 with the job to poll.
+        """
+        ingredients = shopping_cart.items(request.user.id)
+        title = tasks.shopping_list_title(request.user)
+        export_format = request.query_params.get('format', 'pdf')
+
+        if export_format in exports.EXPORTERS:
+            response = StreamingHttpResponse(
+                exports.EXPORTERS[export_format](
+                    title, ingredients.iterator()),
+                content_type=exports.CONTENT_TYPES[export_format])
+            response['Content-Disposition'] = (
+                f'attachment; filename="Foodgram_cart.{export_format}"')
+            return response
+
+        if request.query_params.get('async') in ('1', 'true'):
+            job = jobs.enqueue('shopping_list_pdf', user=request.user)
+            serializer = JobSerializer(job, context={'request': request})
+            return Response(
+                serializer.data, status=status.HTTP_202_ACCEPTED,
+                headers={'Location': reverse(
+                    'jobs-detail', args=(job.pk,), request=request)})
+
+        document = pdf.get_shopping_list(title, ingredients)
+        return FileResponse(io.BytesIO(document), as_attachment=True,
                             filename='Foodgram_cart.pdf')
 
 
@@ -170,6 +379,14 @@ class TagViewSet(ReadOnlyModelViewSet):
     pagination_class = None
     serializer_class = TagSerializer
 
+    @method_decorator(condition(etag_func=tags_etag))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=tags_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     """
@@ -180,3 +397,38 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+
+    @method_decorator(condition(etag_func=ingredients_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=ingredients_etag))
+    def list(self, request, *args, **kwargs):
+        """ Name lookups are answered from the in-memory prefix index """
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        ingredients = ingredient_index.index.search(name)
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
+
+class JobViewSet(mixins.RetrieveModelMixin, GenericViewSet):
+    """ Status of the background jobs started by the current user """
+    serializer_class = JobSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    @action(detail=True)
+    def download(self, request, pk=None):
+        """ Returns the file produced by a finished job """
+        job = self.get_object()
+        if job.status != Job.SUCCEEDED or not job.result_file:
+            return Response(
+                {'detail': 'Job has no file yet.', 'status': job.status},
+                status=status.HTTP_409_CONFLICT)
+        return FileResponse(
+            job.result_file.open('rb'), as_attachment=True,
+            filename=os.path.basename(job.result_file.name))
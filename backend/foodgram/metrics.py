@@ -0,0 +1,403 @@
+""" Per-view request metrics: Server-Timing header and Prometheus histograms.
+
+MetricsMiddleware measures every request: wall time, the number and total
+time of SQL queries on the default connection, time spent producing
+serializer data and the response size. The values are sent back in a
+Server-Timing header and added to histograms labelled with the view and
+the HTTP method.
+
+Other code records its own values with observe() and increment(), e.g. the
+render time and cache hits of shopping list PDFs.
+
+Each process keeps its metrics in memory. Server and job worker processes
+call enable() and then write them to their own file in METRICS_DIR at most
+every METRICS_FLUSH_INTERVAL seconds; other processes, such as management
+commands and tests, never write. The /metrics view sums all the files, so
+any gunicorn worker can answer a scrape with the totals of the whole server.
+When a process is gone, its rows are added to ARCHIVE_FILE before its file
+is deleted, so the totals do not go down when gunicorn recycles a worker or
+a job worker restarts.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from rest_framework import serializers
+
+NAMESPACE = 'foodgram'
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (
+    1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REQUEST_LABELS = ('view', 'method')
+# Rows of the processes that exited, kept in METRICS_DIR
+ARCHIVE_FILE = 'archive.json'
+ARCHIVE_LOCK = 'archive.lock'
+
+# Histogram name: (help text, buckets, label names)
+HISTOGRAMS = {
+    'request_duration_seconds': (
+        'Wall time of the request', DURATION_BUCKETS, REQUEST_LABELS),
+    'sql_queries': (
+        'SQL queries run by the request', QUERY_BUCKETS, REQUEST_LABELS),
+    'sql_duration_seconds': (
+        'Total time of the SQL queries of the request', DURATION_BUCKETS,
+        REQUEST_LABELS),
+    'serializer_duration_seconds': (
+        'Time spent producing serializer data', DURATION_BUCKETS,
+        REQUEST_LABELS),
+    'response_size_bytes': (
+        'Size of non-streaming response bodies', SIZE_BUCKETS,
+        REQUEST_LABELS),
+    'pdf_render_seconds': (
+        'Time to render a shopping list PDF', DURATION_BUCKETS, ()),
+}
+# Counter name: (help text, label names)
+COUNTERS = {
+    'pdf_cache_total': (
+        'Shopping list PDFs served from the cache or rendered',
+        ('result',)),
+    'recipe_list_cache_total': (
+        'Anonymous recipe list pages served from the cache or rendered',
+        ('result',)),
+}
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """ Measurements of the request being handled """
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """ connection.execute_wrapper hook timing every query """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_seconds += time.perf_counter() - started
+
+
+class Registry:
+    """ Metrics of one process, flushed to its file in METRICS_DIR """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        # The start time keeps a process reusing the pid of a dead one
+        # from taking over its file
+        self.file_name = f'{self.pid}-{time.time_ns()}.json'
+        # (histogram name, labels): [bucket counts..., sum, count]
+        # (counter name, labels): [value]
+        self.values = {}
+        self.flushed_at = 0.0
+
+    @property
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, self.file_name)
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            # Forked after the parent recorded something
+            self._reset()
+
+    def _maybe_flush(self):
+        if self.enabled and (time.monotonic() - self.flushed_at
+                             >= settings.METRICS_FLUSH_INTERVAL):
+            self._flush()
+
+    def increment(self, name, labels, amount=1):
+        with self._lock:
+            self._check_fork()
+            self.values.setdefault((name, labels), [0])[0] += amount
+            self._maybe_flush()
+
+    def observe(self, labels, **observations):
+        with self._lock:
+            self._check_fork()
+            for name, value in observations.items():
+                buckets = HISTOGRAMS[name][1]
+                key = (name, labels)
+                if key not in self.values:
+                    self.values[key] = [0] * (len(buckets) + 2)
+                row = self.values[key]
+                for index, bound in enumerate(buckets):
+                    if value <= bound:
+                        row[index] += 1
+                row[-2] += value
+                row[-1] += 1
+            self._maybe_flush()
+
+    def _flush(self):
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_file(self.path, [
+            [name, list(labels), row]
+            for (name, labels), row in self.values.items()
+        ])
+        self.flushed_at = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self.enabled and self.values and self.pid == os.getpid():
+                self._flush()
+
+    def snapshot(self):
+        """ File name and current rows of this process """
+        with self._lock:
+            self._check_fork()
+            return self.file_name, [
+                [name, list(labels), list(row)]
+                for (name, labels), row in self.values.items()
+            ]
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def add_rows(totals, rows):
+    """ Adds file rows to {(name, labels): row} """
+    for name, labels, row in rows:
+        if name not in HISTOGRAMS and name not in COUNTERS:
+            continue
+        total = totals.setdefault((name, tuple(labels)), [0] * len(row))
+        for index, value in enumerate(row):
+            total[index] += value
+
+
+def read_file(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return []
+
+
+def write_file(path, rows):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(rows, file)
+    os.replace(temporary, path)
+
+
+def dead_files(names):
+    for file_name in names:
+        pid = file_name.split('-', 1)[0].split('.', 1)[0]
+        if pid.isdigit() and not is_alive(int(pid)):
+            yield file_name
+
+
+def remove_dead():
+    """ Moves the rows of processes that no longer run to ARCHIVE_FILE """
+    try:
+        names = os.listdir(settings.METRICS_DIR)
+    except FileNotFoundError:
+        return
+    if not any(dead_files(names)):
+        return
+    with open(os.path.join(settings.METRICS_DIR, ARCHIVE_LOCK), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # Another process may have archived them while we waited
+        dead = list(dead_files(os.listdir(settings.METRICS_DIR)))
+        if not dead:
+            return
+        archive = os.path.join(settings.METRICS_DIR, ARCHIVE_FILE)
+        totals = {}
+        add_rows(totals, read_file(archive))
+        for file_name in dead:
+            if file_name.endswith('.json'):
+                add_rows(totals, read_file(
+                    os.path.join(settings.METRICS_DIR, file_name)))
+        write_file(archive, [
+            [name, list(labels), row]
+            for (name, labels), row in totals.items()
+        ])
+        for file_name in dead:
+            try:
+                os.remove(os.path.join(settings.METRICS_DIR, file_name))
+            except FileNotFoundError:
+                pass
+
+
+def enable():
+    """ Lets the current server or worker process write its metrics """
+    registry.enabled = True
+    remove_dead()
+
+
+def observe(name, value, **labels):
+    """ Adds `value` to the histogram `name` """
+    registry.observe(
+        tuple(str(labels[label]) for label in HISTOGRAMS[name][2]),
+        **{name: value})
+
+
+def increment(name, amount=1, **labels):
+    """ Adds `amount` to the counter `name` """
+    registry.increment(
+        name, tuple(str(labels[label]) for label in COUNTERS[name][1]),
+        amount)
+
+
+def instrument_serializers():
+    """ Times the outermost `.data` of every DRF serializer, once """
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        original = cls.data
+        if getattr(original.fget, 'instrumented', False):
+            continue
+
+        def data(self, _original=original):
+            metrics = _current.get()
+            if metrics is None:
+                return _original.fget(self)
+            metrics.serializer_depth += 1
+            started = time.perf_counter()
+            try:
+                return _original.fget(self)
+            finally:
+                metrics.serializer_depth -= 1
+                if not metrics.serializer_depth:
+                    metrics.serializer_seconds += (
+                        time.perf_counter() - started)
+
+        data.instrumented = True
+        cls.data = property(data)
+
+
+def view_name(request):
+    """ 'RecipeViewSet.list' for viewsets, the URL name otherwise """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    cls = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    if cls is not None and actions:
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{cls.__name__}.{action}'
+    if cls is not None:
+        return cls.__name__
+    return match.view_name or match.func.__qualname__
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+        observations = {
+            'request_duration_seconds': elapsed,
+            'sql_queries': metrics.queries,
+            'sql_duration_seconds': metrics.sql_seconds,
+            'serializer_duration_seconds': metrics.serializer_seconds,
+        }
+        if not response.streaming:
+            observations['response_size_bytes'] = len(response.content)
+        registry.observe((view_name(request), request.method), **observations)
+        response['Server-Timing'] = ', '.join((
+            f'app;dur={elapsed * 1000:.1f}',
+            f'db;dur={metrics.sql_seconds * 1000:.1f};'
+            f'desc="{metrics.queries} queries"',
+            f'ser;dur={metrics.serializer_seconds * 1000:.1f}',
+        ))
+        return response
+
+
+def read_files(skip):
+    """ Rows written by the other processes and the archive """
+    try:
+        names = os.listdir(settings.METRICS_DIR)
+    except FileNotFoundError:
+        return
+    for file_name in names:
+        if file_name.endswith('.json') and file_name != skip:
+            yield read_file(os.path.join(settings.METRICS_DIR, file_name))
+
+
+def collect():
+    """ Sums the metrics of this process and the files of the others """
+    remove_dead()
+    own_name, own_rows = registry.snapshot()
+    totals = {}
+    for rows in (own_rows, *read_files(skip=own_name)):
+        add_rows(totals, rows)
+    return totals
+
+
+def format_labels(names, values, **extra):
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def render(totals):
+    """ Prometheus text exposition of the summed metrics """
+    lines = []
+    for name, (help_text, buckets, label_names) in HISTOGRAMS.items():
+        metric = f'{NAMESPACE}_{name}'
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (row_name, labels), row in sorted(totals.items()):
+            if row_name != name:
+                continue
+            for bound, count in zip(buckets, row):
+                lines.append(f'{metric}_bucket'
+                             f'{format_labels(label_names, labels, le=bound)}'
+                             f' {count}')
+            lines.append(f'{metric}_bucket'
+                         f'{format_labels(label_names, labels, le="+Inf")}'
+                         f' {row[-1]}')
+            plain = format_labels(label_names, labels)
+            lines.append(f'{metric}_sum{plain} {row[-2]}')
+            lines.append(f'{metric}_count{plain} {row[-1]}')
+    for name, (help_text, label_names) in COUNTERS.items():
+        metric = f'{NAMESPACE}_{name}'
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for (row_name, labels), row in sorted(totals.items()):
+            if row_name == name:
+                lines.append(
+                    f'{metric}{format_labels(label_names, labels)} {row[0]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(
+        render(collect()), content_type='text/plain; version=0.0.4')
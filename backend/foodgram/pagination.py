@@ -1,5 +1,82 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CachedCountPaginator(Paginator):
+    """ Paginator whose count is cached per query and `version`.
+        Unfiltered lists may use the planner's row estimate instead.
+    """
+    def __init__(self, *args, version='', **kwargs):
+        self.version = version
+        super().__init__(*args, **kwargs)
+
+    def _estimated_count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if (not settings.PAGE_ESTIMATED_COUNT
+                or connection.vendor != 'postgresql'
+                or queryset.query.where or queryset.query.distinct):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row is None or row[0] < settings.PAGE_ESTIMATED_COUNT_THRESHOLD:
+            return None
+        return int(row[0])
+
+    @cached_property
+    def count(self):
+        sql, params = self.object_list.query.sql_with_params()
+        signature = f'{self.version}:{sql}:{params!r}'
+        key = f'page-count:{hashlib.sha256(signature.encode()).hexdigest()}'
+        count = cache.get(key)
+        if count is None:
+            count = self._estimated_count()
+            if count is None:
+                # Only primary keys are needed, annotations stay out of it
+                count = self.object_list.values('pk').count()
+            cache.set(key, count, settings.PAGE_COUNT_CACHE_TIMEOUT)
+        return count
 
 
 class LimitPageNumberPaginator(PageNumberPagination):
+    """ Counts are cached until the view's `get_count_version()` changes """
     page_size_query_param = 'limit'
+    max_page_size = settings.PAGE_MAX_LIMIT
+
+    def paginate_queryset(self, queryset, request, view=None):
+        get_version = getattr(view, 'get_count_version', None)
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            version=get_version() if get_version else '')
+        return super().paginate_queryset(queryset, request, view)
+
+
+class LimitCursorPaginator(CursorPagination):
+    """ Keyset pagination: no COUNT(*) and no OFFSET, flat on deep pages.
+        Pages are always ordered by descending id, the only unique key a
+        cursor can safely resume from: ?ordering= is ignored and ?search=
+        results come in id order instead of by rank.
+    """
+    page_size_query_param = 'limit'
+    max_page_size = settings.PAGE_MAX_LIMIT
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        # DRF would take the ordering of the view's OrderingFilter
+        return (self.ordering,)
+
+    @classmethod
+    def is_requested(cls, request):
+        """ Chosen per request with '?pagination=cursor' or by a cursor """
+        return (request.query_params.get('pagination') == 'cursor'
+                or cls.cursor_query_param in request.query_params)
@@ -1,4 +1,6 @@
 import os
+import sys
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -22,6 +24,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -40,6 +43,15 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
 }
 
+# Largest '?limit=' accepted by the paginators
+PAGE_MAX_LIMIT = int(os.getenv('PAGE_MAX_LIMIT', 100))
+# Seconds a page count is reused for the same filters
+PAGE_COUNT_CACHE_TIMEOUT = int(os.getenv('PAGE_COUNT_CACHE_TIMEOUT', 30))
+# Use planner row estimates instead of COUNT(*) for unfiltered lists
+PAGE_ESTIMATED_COUNT = os.getenv('PAGE_ESTIMATED_COUNT', '') == 'True'
+PAGE_ESTIMATED_COUNT_THRESHOLD = int(
+    os.getenv('PAGE_ESTIMATED_COUNT_THRESHOLD', 100000))
+
 DJOSER = {
     'USER_ID_FIELD': 'id',
     'LOGIN_FIELD': 'email',
@@ -57,6 +69,7 @@ DJOSER = {
 }
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +99,26 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+CACHES = {
+    # Responses shared by every worker and container: recipe list pages,
+    # catalogs, shopping list PDFs and page counts
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'foodgram_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # Version stamps of api.versions. Never culled: a lost stamp changes
+    # Last-Modified and ETags and misses every cached response.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'foodgram_versions',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': sys.maxsize},
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -129,5 +162,38 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'backend-static')
 
 MEDIA_URL = '/backend_media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'backend-media')
+# Files handed out only by the API after a permission check, such as job
+# results. Must not be served by the web server.
+PRIVATE_MEDIA_ROOT = os.getenv(
+    'PRIVATE_MEDIA_ROOT', os.path.join(BASE_DIR, 'backend-private'))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Threads resizing uploaded recipe photos, per process
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+# Largest recipe photo accepted, in bytes, and its longest side in pixels
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024))
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', 6000))
+
+# POST /api/recipes/bulk/: most recipes per call and largest JSON body, in
+# bytes. The body is parsed from the stream, DATA_UPLOAD_MAX_MEMORY_SIZE
+# does not apply to it. Keep client_max_body_size in nginx.conf in line.
+RECIPE_BULK_CREATE_LIMIT = int(os.getenv('RECIPE_BULK_CREATE_LIMIT', 5000))
+RECIPE_BULK_MAX_BODY_SIZE = int(os.getenv('RECIPE_BULK_MAX_BODY_SIZE', 512 * 1024 * 1024))
+
+# Background jobs: seconds before a retry (doubled on each attempt) and
+# before a job left running by a dead worker is picked up again
+JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', 10))
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 600))
+# Seconds a finished job and its file are kept, see purge_jobs
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 24 * 60 * 60))
+# Default pool of the run_workers command
+JOB_WORKER_PROCESSES = int(os.getenv('JOB_WORKER_PROCESSES', 1))
+JOB_WORKER_THREADS = int(os.getenv('JOB_WORKER_THREADS', 4))
+# Generate photo variants in run_workers instead of the web process
+IMAGE_VARIANT_JOBS = os.getenv('IMAGE_VARIANT_JOBS', '') == 'True'
+
+# Per-process request histograms, summed by the /metrics view
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'foodgram-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
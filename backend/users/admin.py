@@ -4,9 +4,19 @@ from users import models
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'email')
+    list_display = ('username', 'email', 'recipes_count', 'followers_count')
+    search_fields = ('username', 'email')
+    ordering = ('id',)
+    show_full_result_count = False
     empty_value_display = '-empty-'
 
 
-admin.site.register(models.Follow)
+class FollowAdmin(admin.ModelAdmin):
+    list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
+
+
+admin.site.register(models.Follow, FollowAdmin)
 admin.site.register(models.CustomUser, UserAdmin)
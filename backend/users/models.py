@@ -4,6 +4,10 @@ from django.db import models
 
 class CustomUser(AbstractUser):
     email = models.EmailField(unique=True)
+    recipes_count = models.IntegerField(
+        default=0, editable=False, verbose_name='Рецептов')
+    followers_count = models.IntegerField(
+        default=0, editable=False, verbose_name='Подписчиков')
 
     class Meta:
         verbose_name = 'Пользователь'